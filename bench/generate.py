@@ -0,0 +1,192 @@
+"""
+Synthetic Twitter dump generator
+
+The real dumps can't be shared, so benchmarks run on generated ones.
+Every line is a v1.1-style tweet object with the fields process.py reads
+and some it doesn't (entities, place, geo, source, ...), covering:
+
+    retweets            about half the lines, with the full parent in
+                        retweeted_status (and its quoted_status, if any)
+    quote retweets      about a tenth, with quoted_status / quoted_status_id
+    replies             in_reply_to_* set on a tenth of tweets
+    hashtags            0-3 per tweet, in mixed case
+    duplicates          about 1% of lines repeat a recent line
+
+Users and retweets are skewed like the real data: a Pareto-distributed
+handful of accounts write a large share of the tweets, follower counts
+are heavy-tailed, and the first HOT_TWEETS tweets stay retweetable for the
+whole run and collect most of the retweets. created_at strings use
+Twitter's format and span one day from 2017-08-14 02:00 UTC.
+
+Users are derived from their index and only HOT_TWEETS + POOL_TWEETS
+parent tweets are kept, so memory stays flat at any size. Output is
+deterministic for a size and seed:
+    python bench/generate.py 100k [seed] > data/synthetic_100k.json
+"""
+
+import sys
+import json
+import random
+from datetime import datetime, timezone, timedelta
+
+SIZES = {"10k":10000, "100k":100000, "1m":1000000, "5m":5000000}
+# parent tweets kept for retweets and quotes: the first HOT_TWEETS for the
+# whole run, then a pool of POOL_TWEETS that recent tweets replace at random
+HOT_TWEETS = 1000
+POOL_TWEETS = 50000
+# recent lines a duplicate line is picked from
+RECENT_LINES = 1000
+
+WORDS = "the a charlottesville rally virginia protest march police love hate peace unite right left news today".split()
+HASHTAGS = ["Charlottesville", "charlottesville", "UniteTheRight", "NoHate", "Virginia", "news"]
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+START = datetime(2017, 8, 14, 2, 0, tzinfo=timezone.utc)
+
+'''
+Twitter's created_at format, e.g. "Mon Aug 14 02:00:00 +0000 2017"
+'''
+def twitter_time(dt):
+    return "%s %s %02d %02d:%02d:%02d +0000 %d" % (DAYS[dt.weekday()], MONTHS[dt.month-1], dt.day,
+                                                    dt.hour, dt.minute, dt.second, dt.year)
+
+class DumpGenerator:
+    def __init__(self, line_count, seed=1):
+        self.line_count = line_count
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.user_count = max(10, line_count//3)
+        self.next_id = 896000000000000000
+        self.parents = []
+
+    '''
+    The user at index, the same every time it's asked for apart from a
+    slowly growing follower count
+    '''
+    def user(self, index):
+        rng = random.Random(self.seed*1000003 + index)
+        user_id = 10000 + index*7
+        followers_count = int(rng.paretovariate(0.8)*50) if rng.random() > 0.05 else 0
+        return {
+            "id":user_id,
+            "id_str":str(user_id),
+            "name":"User\n"+str(index),
+            "screen_name":"user"+str(index),
+            "location":rng.choice([None, "", "VA", "Charlottesville, VA"]),
+            "description":rng.choice(["", None, "I like\nthings", "news"]),
+            "verified":rng.random() < 0.02,
+            "followers_count":followers_count + self.rng.randint(0, 2) if followers_count else 0,
+            "friends_count":rng.randint(0, 3000),
+            "created_at":twitter_time(datetime(2007, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=rng.randint(0, 10**9//3))),
+            "profile_image_url_https":"https://pbs.twimg.com/profile_images/"+str(user_id)+"/a_normal.jpg",
+        }
+
+    '''
+    A tweet author: half the time from a Pareto head of heavy posters
+    '''
+    def author(self):
+        rng = self.rng
+        if rng.random() < 0.5:
+            return self.user(min(int(rng.paretovariate(1.2)) - 1, self.user_count - 1))
+        return self.user(rng.randrange(self.user_count))
+
+    '''
+    A parent to retweet or quote, mostly from the hot tweets
+    '''
+    def parent(self):
+        rng = self.rng
+        if rng.random() < 0.7:
+            return self.parents[min(int(rng.paretovariate(0.7)) - 1, len(self.parents) - 1)]
+        return rng.choice(self.parents)
+
+    def add_parent(self, tweet):
+        if len(self.parents) < HOT_TWEETS + POOL_TWEETS:
+            self.parents.append(tweet)
+        else:
+            self.parents[self.rng.randrange(HOT_TWEETS, HOT_TWEETS + POOL_TWEETS)] = tweet
+
+    def tweet(self, created_at):
+        rng = self.rng
+        self.next_id += rng.randint(1, 5000)
+        text = " ".join(rng.choice(WORDS) for i in range(rng.randint(3, 15)))
+        tweet = {
+            "created_at":twitter_time(created_at),
+            "id":self.next_id,
+            "id_str":str(self.next_id),
+            "text":text + ("\nmore" if rng.random() < 0.1 else ""),
+            "source":"<a href=\"https://twitter.com\" rel=\"nofollow\">Twitter Web Client</a>",
+            "truncated":False,
+            "in_reply_to_status_id":None,
+            "in_reply_to_status_id_str":None,
+            "in_reply_to_user_id_str":None,
+            "in_reply_to_screen_name":None,
+            "user":self.author(),
+            "geo":None,
+            "place":None,
+            "entities":{"hashtags":[{"text":rng.choice(HASHTAGS), "indices":[0, 0]} for i in range(rng.choice([0, 0, 1, 2, 3]))],
+                        "urls":[], "user_mentions":[], "symbols":[]},
+            "favorite_count":rng.choice([0, 0, rng.randint(0, 5000)]),
+            "retweet_count":rng.choice([0, rng.randint(0, 9000)]),
+            "favorited":False,
+            "retweeted":False,
+            "lang":"en",
+        }
+        if rng.random() < 0.1 and self.parents:
+            parent = rng.choice(self.parents)
+            tweet["in_reply_to_status_id"] = parent["id"]
+            tweet["in_reply_to_status_id_str"] = parent["id_str"]
+            tweet["in_reply_to_user_id_str"] = parent["user"]["id_str"]
+            tweet["in_reply_to_screen_name"] = parent["user"]["screen_name"]
+        return tweet
+
+    '''
+    Yield line_count JSON lines
+    '''
+    def iter_lines(self):
+        rng = self.rng
+        recent = []
+        line_count = 0
+        while line_count < self.line_count:
+            created_at = START + timedelta(seconds=line_count*86400//self.line_count + rng.randint(0, 3))
+            kind = rng.random()
+            tweet = self.tweet(created_at)
+            if kind < 0.55 and self.parents:
+                parent = self.parent()
+                tweet["text"] = "RT @"+parent["user"]["screen_name"]+": "+parent["text"]
+                tweet["retweeted_status"] = dict(parent, favorite_count=parent["favorite_count"] + rng.randint(0, 3))
+                tweet["entities"] = parent["entities"]
+                for key in ["quoted_status", "quoted_status_id", "quoted_status_id_str"]:
+                    if key in parent:
+                        tweet[key] = parent[key]
+            elif kind < 0.65 and self.parents:
+                quoted = self.parent()
+                # like the API, a quoted tweet doesn't carry its own quoted_status
+                tweet["quoted_status"] = {k:v for k, v in quoted.items() if k != "quoted_status"}
+                tweet["quoted_status_id"] = quoted["id"]
+                tweet["quoted_status_id_str"] = quoted["id_str"]
+                self.add_parent(tweet)
+            else:
+                self.add_parent(tweet)
+            line = json.dumps(tweet)+"\n"
+            yield line
+            line_count += 1
+            if len(recent) < RECENT_LINES:
+                recent.append(line)
+            else:
+                recent[rng.randrange(RECENT_LINES)] = line
+            if rng.random() < 0.01 and line_count < self.line_count:
+                yield rng.choice(recent)
+                line_count += 1
+
+'''
+Write a dump of line_count lines to path
+'''
+def generate(path, line_count, seed=1):
+    with open(path, "w", encoding="UTF-8") as outfile:
+        outfile.writelines(DumpGenerator(line_count, seed).iter_lines())
+
+
+if __name__ == "__main__":
+    line_count = SIZES[sys.argv[1]] if sys.argv[1] in SIZES else int(sys.argv[1])
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    sys.stdout.writelines(DumpGenerator(line_count, seed).iter_lines())
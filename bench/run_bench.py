@@ -0,0 +1,148 @@
+"""
+End-to-end benchmark
+
+Runs each stage of the pipeline on generated dumps (see generate.py) and
+records, per size and stage, wall and CPU time, lines per second and peak
+RSS:
+
+    process         process/process.py, the display files
+    user_text       process/process_user_text.py, the user text corpus
+    lunr            lunr/build_index.py over the display files
+    pseudonyms      obfuscation/collisions.py over the dump, hashing every
+                    user into a fresh pseudonym cache and checking it
+
+Each stage runs as its own process in WORK_DIR (which gets data/ and
+output/ like the repo root), with the current settings of each script.
+Peak RSS is the stage process's own, not that of any worker processes it
+starts. Generated dumps are kept in WORK_DIR/data and reused.
+
+Results go to bench/results.json and are compared with bench/baseline.json,
+flagging any stage more than TOLERANCE slower or larger than its baseline
+(the exit status is then 1). The baseline is machine specific: save one
+with --save-baseline on the machine the comparisons run on.
+    python bench/run_bench.py [10k 100k 1m 5m] [--stages=process,lunr] [--save-baseline]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import subprocess
+
+from generate import SIZES
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = os.path.join(REPO_DIR, "bench", "work")
+RESULTS_PATH = os.path.join(REPO_DIR, "bench", "results.json")
+BASELINE_PATH = os.path.join(REPO_DIR, "bench", "baseline.json")
+DEFAULT_SIZES = ["10k", "100k"]
+SEED = 1
+# relative slowdown (or RSS growth) over the baseline reported as a regression
+TOLERANCE = 0.2
+
+'''
+The command line of each stage for a data file, run in WORK_DIR
+'''
+STAGES = {
+    "process":lambda filename: [sys.executable, os.path.join(REPO_DIR, "process", "process.py"), filename],
+    "user_text":lambda filename: [sys.executable, os.path.join(REPO_DIR, "process", "process_user_text.py"), filename],
+    "lunr":lambda filename: [sys.executable, os.path.join(REPO_DIR, "lunr", "build_index.py")],
+    "pseudonyms":lambda filename: [sys.executable, os.path.join(REPO_DIR, "obfuscation", "collisions.py"), "./data/"+filename],
+}
+
+'''
+Run one stage to completion, returning its wall time and the CPU time and
+peak RSS of its process
+'''
+def run_stage(command):
+    start = time.perf_counter()
+    stage_process = subprocess.Popen(command, cwd=WORK_DIR, stdout=subprocess.DEVNULL)
+    pid, status, usage = os.wait4(stage_process.pid, 0)
+    seconds = time.perf_counter() - start
+    # reaped by wait4, so tell Popen
+    stage_process.returncode = os.waitstatus_to_exitcode(status)
+    if stage_process.returncode:
+        raise RuntimeError(" ".join(command)+" exited with "+str(stage_process.returncode))
+    return seconds, usage.ru_utime + usage.ru_stime, usage.ru_maxrss/1024
+
+'''
+Generate (or reuse) the dump of a size and run the stages on it
+'''
+def bench_size(size, stages):
+    filename = "synthetic_"+size+"_"+str(SEED)+".json"
+    os.makedirs(os.path.join(WORK_DIR, "data"), exist_ok=True)
+    path = os.path.join(WORK_DIR, "data", filename)
+    if not os.path.exists(path):
+        print("Generating", filename)
+        # in its own process, as a child's peak RSS counts the memory of
+        # the process it was forked from
+        with open(path+".tmp", "w") as outfile:
+            subprocess.run([sys.executable, os.path.join(REPO_DIR, "bench", "generate.py"), size, str(SEED)],
+                           stdout=outfile, check=True)
+        os.replace(path+".tmp", path)
+
+    # every run starts from an empty output directory and pseudonym cache
+    shutil.rmtree(os.path.join(WORK_DIR, "output"), ignore_errors=True)
+    os.makedirs(os.path.join(WORK_DIR, "output"))
+    if os.path.exists(os.path.join(WORK_DIR, "data", "pseudonyms.sqlite")):
+        os.remove(os.path.join(WORK_DIR, "data", "pseudonyms.sqlite"))
+
+    results = {}
+    for stage in stages:
+        seconds, cpu_seconds, peak_rss_mb = run_stage(STAGES[stage](filename))
+        results[stage] = {
+            "seconds":round(seconds, 3),
+            "cpu_seconds":round(cpu_seconds, 3),
+            "lines_per_second":round(SIZES[size]/seconds),
+            "peak_rss_mb":round(peak_rss_mb, 1),
+        }
+        print(size, stage, results[stage])
+    return results
+
+'''
+Compare results with the baseline, returning the regressions
+'''
+def compare(results, baseline):
+    regressions = []
+    for size, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            if base is None:
+                continue
+            time_ratio = result["seconds"]/base["seconds"]
+            rss_ratio = result["peak_rss_mb"]/base["peak_rss_mb"]
+            flag = ""
+            if time_ratio > 1+TOLERANCE or rss_ratio > 1+TOLERANCE:
+                flag = "  REGRESSION"
+                regressions.append((size, stage))
+            print("%-5s %-10s time x%.2f  rss x%.2f%s" % (size, stage, time_ratio, rss_ratio, flag))
+    return regressions
+
+
+if __name__ == "__main__":
+    sizes = [arg for arg in sys.argv[1:] if not arg.startswith("--")] or DEFAULT_SIZES
+    stages = list(STAGES)
+    for arg in sys.argv[1:]:
+        if arg.startswith("--stages="):
+            stages = arg.split("=", 1)[1].split(",")
+    for name in sizes + stages:
+        if name not in SIZES and name not in STAGES:
+            sys.exit("unknown size or stage: "+name)
+
+    results = {size:bench_size(size, stages) for size in sizes}
+    run = {"python":platform.python_version(), "machine":platform.machine(), "cpus":os.cpu_count(), "results":results}
+    with open(RESULTS_PATH, "w") as outfile:
+        json.dump(run, outfile, indent=1)
+
+    if "--save-baseline" in sys.argv:
+        with open(BASELINE_PATH, "w") as outfile:
+            json.dump(run, outfile, indent=1)
+        print("Saved baseline", BASELINE_PATH)
+    elif os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as infile:
+            if compare(results, json.load(infile)["results"]):
+                sys.exit(1)
+    else:
+        print("No baseline yet, save one with --save-baseline")
@@ -0,0 +1,111 @@
+"""
+Exact-match facet indexes for the viewer
+
+Lunr only covers full-text fields. For filters on hashtag, local_date,
+user size (the USER_SIZE_BOUNDS bucket) and verified, this writes posting
+lists instead: for every value of a facet, the sorted ordinals of the
+tweets that have it. A tweet's ordinal is its position across the
+disp_tw_ chunk files in file order, the same position the sort_*.bin
+files use, so a page of results maps straight to chunk files.
+Time-partitioned output gets facets per partition as well,
+facets_<facet>_<partition name>.json, counting positions within the
+partition like its own sort lists do.
+
+Each list is delta-encoded (the first ordinal, then the gaps) which keeps
+the numbers, and so the JSON, small. Facets go to one file each,
+facets_<facet>.json, as {value: deltas}, so the viewer only loads the
+facets a query filters on, and a query like "#charlottesville on
+2017-08-12 from large verified accounts" is an intersection of four
+lists, starting from the shortest, whatever the size of the corpus.
+
+Build from the directory holding output/, like build_index.py:
+    python lunr/build_facets.py
+Query the built facets (of a partition with partition=<name>):
+    python lunr/build_facets.py hashtag=charlottesville local_date=2017-08-12 size=2 verified=true
+"""
+
+import sys
+import json
+
+from chunk_files import chunk_files, all_chunk_files
+
+# chunk files in file order (see chunk_files.py), partitions by name
+TWEET_FILES = [path for paths in chunk_files("disp_tw_").values() for path in paths]
+PARTITION_TWEET_FILES = chunk_files("disp_tw_", partitions=True)
+USER_FILES = all_chunk_files("disp_u_")
+
+FACETS = ["hashtag", "local_date", "size", "verified"]
+
+def delta_encode(ordinals):
+    return [ordinal - previous for ordinal, previous in zip(ordinals, [0]+ordinals[:-1])]
+
+def delta_decode(deltas):
+    ordinals = []
+    ordinal = 0
+    for delta in deltas:
+        ordinal += delta
+        ordinals.append(ordinal)
+    return ordinals
+
+'''
+Intersect delta-encoded posting lists, shortest first
+'''
+def intersect_postings(posting_lists):
+    posting_lists = sorted(posting_lists, key=len)
+    ordinals = delta_decode(posting_lists[0]) if posting_lists else []
+    for deltas in posting_lists[1:]:
+        if not ordinals:
+            break
+        matching = set(ordinals)
+        ordinals = [ordinal for ordinal in delta_decode(deltas) if ordinal in matching]
+    return ordinals
+
+'''
+Return {facet: {value: sorted ordinals}} for the display tweets
+'''
+def collect_facets(tweet_files, user_files):
+    user_sizes = {}
+    for filename in user_files:
+        with open(filename,"r",-1,"UTF-8") as infile:
+            for userid, user in json.load(infile).items():
+                user_sizes[userid] = user["size"]
+
+    facets = {facet:{} for facet in FACETS}
+    ordinal = 0
+    for filename in tweet_files:
+        with open(filename,"r",-1,"UTF-8") as infile:
+            tweets = json.load(infile)
+        for tweet in tweets.values():
+            values = [("local_date", tweet["local_date"]),
+                      ("size", str(user_sizes.get(tweet["user_id"]))),
+                      ("verified", "true" if tweet.get("verified") else "false")]
+            values += [("hashtag", hashtag) for hashtag in tweet["hashtags"]]
+            for facet, value in values:
+                facets[facet].setdefault(value, []).append(ordinal)
+            ordinal += 1
+    return facets
+
+def facet_filename(facet, name=None):
+    return "./output/facets_"+facet+("_"+name if name else "")+".json"
+
+def load_facet(facet, name=None):
+    with open(facet_filename(facet, name),"r",-1,"UTF-8") as infile:
+        return json.load(infile)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        query = [argument.split("=", 1) for argument in sys.argv[1:]]
+        name = dict(query).get("partition")
+        query = [(facet, value) for facet, value in query if facet != "partition"]
+        facets = {facet:load_facet(facet, name) for facet in set(facet for facet, value in query)}
+        ordinals = intersect_postings([facets[facet].get(value.lower() if facet == "hashtag" else value, []) for facet, value in query])
+        print(len(ordinals), "tweets:", ordinals[:20])
+    else:
+        outputs = [(None, TWEET_FILES)] if TWEET_FILES else []
+        outputs += list(PARTITION_TWEET_FILES.items())
+        for name, tweet_files in outputs:
+            for facet, postings in collect_facets(tweet_files, USER_FILES).items():
+                with open(facet_filename(facet, name), "w") as outfile:
+                    json.dump({value:delta_encode(ordinals) for value, ordinals in sorted(postings.items())}, outfile, separators=(",",":"))
+                print((name+" " if name else "")+facet+":", len(postings), "values")
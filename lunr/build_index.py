@@ -2,17 +2,18 @@ from lunr import lunr
 
 import os
 import json
+import hashlib
+from multiprocessing import Pool
+
+from chunk_files import all_chunk_files
 
 # DATA_FILES = [
 #     "charlottesville_0010.json",
 #     "charlottesville_0100000.json"
 # ]
 
-DATA_FILES = []
-for filename in os.listdir("./output"):
-    if filename.startswith("disp_tw_") and filename.endswith(".json"):
-        path = os.path.join("./output/", filename)
-        DATA_FILES.append(path)
+# in file order, so shards cover consecutive chunks (see chunk_files.py)
+DATA_FILES = all_chunk_files("disp_tw_")
 
 INDEX_TWEET_SCHEMA = [
     "id",
@@ -21,20 +22,105 @@ INDEX_TWEET_SCHEMA = [
     "hashtags"
 ]
 
+# build one index per SHARD_CHUNKS chunk files (index-000.json, ...) in a
+# process pool, with index_manifest.json describing the shards so the
+# viewer only loads the ones it needs. 0 builds the single index.json.
+# The manifest keeps a hash of the indexed content of every chunk and
+# shard, and a shard whose hash hasn't changed isn't rebuilt; delete
+# index_manifest.json to rebuild them all.
+SHARD_CHUNKS = 0
+SHARD_WORKERS = os.cpu_count()
+
+'''
+Builds index documents out of display tweet chunk files, returning them
+with the (id, local_date) of every tweet
+'''
+def load_index_tweets(filenames):
+    index_tweets = []
+    keys = []
+    for filename in filenames:
+        with open(filename,"r",-1,"UTF-8") as infile:
+            tweets = json.load(infile)
+            for tweet in tweets.values():
+                index_tweet = {}
+                for target in INDEX_TWEET_SCHEMA:
+                    index_tweet[target] = tweet[target]
+                index_tweets.append(index_tweet)
+                keys.append((int(tweet["id"]), tweet["local_date"]))
+    return index_tweets, keys
+
+def build_index(index_tweets, index_fn):
+    idx = lunr(ref=INDEX_TWEET_SCHEMA[0],fields=tuple(INDEX_TWEET_SCHEMA[1:]),documents=index_tweets)
+    serialized_idx = idx.serialize()
+    with open(index_fn, 'w') as outfile:
+        json.dump(serialized_idx, outfile)
+
+'''
+Hash what a chunk file contributes to an index: its index documents and
+the keys kept in the manifest. Changes to anything else in the chunk,
+like retweet lists and counts, don't need the index rebuilt.
+'''
+def chunk_hash(filename):
+    index_tweets, keys = load_index_tweets([filename])
+    return hashlib.sha256(json.dumps([index_tweets, keys]).encode("UTF-8")).hexdigest()
+
+def shard_hash(chunk_hashes):
+    return hashlib.sha256(json.dumps([INDEX_TWEET_SCHEMA, chunk_hashes]).encode("UTF-8")).hexdigest()
+
 '''
-Builds index out of 
+Build and write one shard index, returning its manifest entry: the chunk
+files it covers with their hashes, its document count and the id and
+local_date ranges of its tweets
 '''
-index_tweets = []
-for filename in DATA_FILES:
-    with open(filename,"r",-1,"UTF-8") as infile:
-        tweets = json.load(infile)
-        for tweet in tweets.values():
-            index_tweet = {}
-            for target in INDEX_TWEET_SCHEMA:
-                index_tweet[target] = tweet[target]
-            index_tweets.append(index_tweet)
-
-idx = lunr(ref=INDEX_TWEET_SCHEMA[0],fields=tuple(INDEX_TWEET_SCHEMA[1:]),documents=index_tweets)
-serialized_idx = idx.serialize()
-with open('./output/index.json', 'w') as outfile:
-    json.dump(serialized_idx, outfile)
\ No newline at end of file
+def build_shard(shard):
+    index_fn, filenames, chunk_hashes = shard
+    index_tweets, keys = load_index_tweets(filenames)
+    build_index(index_tweets, index_fn)
+    ids = [id for id, local_date in keys]
+    dates = [local_date for id, local_date in keys]
+    return {
+        "file":os.path.basename(index_fn),
+        "hash":shard_hash(chunk_hashes),
+        "chunks":[os.path.basename(filename) for filename in filenames],
+        "chunk_hashes":chunk_hashes,
+        "documents":len(index_tweets),
+        "min_id":str(min(ids)) if ids else None,
+        "max_id":str(max(ids)) if ids else None,
+        "first_date":min(dates) if dates else None,
+        "last_date":max(dates) if dates else None,
+    }
+
+
+if __name__ == "__main__":
+    if SHARD_CHUNKS:
+        # shards of the last build, by index file
+        built = {}
+        if os.path.exists('./output/index_manifest.json'):
+            with open('./output/index_manifest.json', 'r', -1, "UTF-8") as infile:
+                built = {entry["file"]:entry for entry in json.load(infile)["shards"]}
+
+        with Pool(SHARD_WORKERS) as pool:
+            chunk_hashes = pool.map(chunk_hash, DATA_FILES)
+            entries = []
+            shards = []
+            for i in range(0, len(DATA_FILES), SHARD_CHUNKS):
+                index_fn = "./output/index-"+str(len(entries)).zfill(3)+".json"
+                entry = built.get(os.path.basename(index_fn))
+                if entry is not None and entry["hash"] == shard_hash(chunk_hashes[i:i+SHARD_CHUNKS]) and os.path.exists(index_fn):
+                    entries.append(entry)
+                else:
+                    entries.append(None)
+                    shards.append((index_fn, DATA_FILES[i:i+SHARD_CHUNKS], chunk_hashes[i:i+SHARD_CHUNKS]))
+            print("Rebuilding", len(shards), "of", len(entries), "index shards")
+            new_entries = iter(pool.map(build_shard, shards))
+            entries = [entry if entry is not None else next(new_entries) for entry in entries]
+
+        # remove shards left over from a build with more of them
+        for index_file in set(built) - set(entry["file"] for entry in entries):
+            if os.path.exists("./output/"+index_file):
+                os.remove("./output/"+index_file)
+        with open('./output/index_manifest.json', 'w') as outfile:
+            json.dump({"ref":INDEX_TWEET_SCHEMA[0], "fields":INDEX_TWEET_SCHEMA[1:], "shards":entries}, outfile)
+    else:
+        index_tweets, keys = load_index_tweets(DATA_FILES)
+        build_index(index_tweets, './output/index.json')
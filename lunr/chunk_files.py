@@ -0,0 +1,53 @@
+"""
+Display chunk files in output/
+
+Chunk files are named <prefix><name>-<n>.json with n zero-padded to three
+digits, so past 999 chunks their names no longer sort in file order
+("-1000" sorts before "-101"). Files are ordered here by name and the
+parsed n instead, the order positions in the sort_*.bin files count in.
+
+Time-partitioned output (see process/display.py) writes its own chunks
+and sort lists per partition, named <output>_<partition> and listed in
+partitions_<output>.json, so partition chunks are kept apart from the
+others.
+"""
+
+import os
+import re
+import json
+
+CHUNK_FILENAME = re.compile(r"^(disp_tw_|disp_u_)(.+)-(\d+)\.json$")
+
+'''
+The names of the partitions listed in partitions_*.json
+'''
+def partition_names(output_dir="./output/"):
+    names = set()
+    for filename in os.listdir(output_dir):
+        if filename.startswith("partitions_") and filename.endswith(".json"):
+            with open(os.path.join(output_dir, filename), "r", -1, "UTF-8") as infile:
+                names.update(partition["name"] for partition in json.load(infile)["partitions"])
+    return names
+
+'''
+Return {name: [paths in file order]} for the prefix's chunk files
+("disp_tw_" or "disp_u_"): the partitions' with partitions, otherwise
+all the others
+'''
+def chunk_files(prefix, output_dir="./output/", partitions=False):
+    partitioned = partition_names(output_dir)
+    files = {}
+    for filename in os.listdir(output_dir):
+        match = CHUNK_FILENAME.match(filename)
+        if match is None or match.group(1) != prefix or (match.group(2) in partitioned) != partitions:
+            continue
+        files.setdefault(match.group(2), []).append((int(match.group(3)), os.path.join(output_dir, filename)))
+    return {name:[path for n, path in sorted(files[name])] for name in sorted(files)}
+
+'''
+The prefix's chunk files in file order, outputs by name. Partition chunks
+are only listed when the output has nothing else, partitions in order.
+'''
+def all_chunk_files(prefix, output_dir="./output/"):
+    files = chunk_files(prefix, output_dir) or chunk_files(prefix, output_dir, partitions=True)
+    return [path for name in files for path in files[name]]
@@ -0,0 +1,111 @@
+"""
+Pseudonym collision detection and resolution
+
+With 61-bit pseudonyms the odds of two of ~2M users sharing one are small
+(see user_obfuscation.py) but not zero, and nothing else checks. The
+pseudonym cache (see pseudonyms.py) holds every user id pseudonymized
+across all datasets, so the check runs over it: the cached values are
+read in sorted order into a packed array("Q"), 8 bytes a user (16MB at
+2M users), and collisions are equal neighbours. Sorting happens in
+sqlite, which spills to disk rather than growing without bound.
+
+Pseudonyms written out must keep meaning the same user, so a value is
+pinned to its user once a check has passed over it, and a pinned user
+keeps its value whatever joins the cache later. Of the ids sharing a
+value, the pinned one keeps it; when none is pinned (they all arrived
+since the last check) the lowest id does, whatever order they arrived
+in. Each other id gets the value of "<id>#<attempt>" (hashed like a user
+id, attempt counting up from 1 past any earlier attempt for the id) that
+isn't taken by any other user. Resolutions are written to the cache, so
+the pseudonyms written afterwards are unique, and appended to its
+resolutions table.
+
+PseudonymSink resolves collisions before writing. To check the cache by
+hand, optionally adding the users of some data files first:
+    python obfuscation/collisions.py [--report] [data/file.json ...]
+"""
+
+import json
+from array import array
+from bisect import bisect_left
+
+from pseudonyms import pseudonym_value
+
+'''
+The cached pseudonym values of every user, sorted, as a packed array
+'''
+def sorted_values(pseudonymizer):
+    values = array("Q")
+    cursor = pseudonymizer.db.execute("SELECT value FROM pseudonyms ORDER BY value")
+    while True:
+        rows = cursor.fetchmany(100000)
+        if not rows:
+            return values
+        values.extend(value for (value,) in rows)
+
+'''
+Yield each value that occurs more than once in sorted values
+'''
+def iter_collisions(values):
+    previous = None
+    for i in range(1, len(values)):
+        if values[i] == values[i-1] and values[i] != previous:
+            previous = values[i]
+            yield previous
+
+def is_taken(values, value):
+    i = bisect_left(values, value)
+    return i < len(values) and values[i] == value
+
+'''
+Find the collisions in the cache and, unless report_only, resolve them
+and pin every value. Returns [(value, [user ids sharing it, the one
+keeping it first])].
+'''
+def resolve_collisions(pseudonymizer, report_only=False):
+    values = sorted_values(pseudonymizer)
+    db = pseudonymizer.db
+    collisions = []
+    assigned = set()
+    for value in list(iter_collisions(values)):
+        # pinned first, then by id
+        user_ids = [user_id for user_id, pinned in
+                    db.execute("SELECT id, pinned FROM pseudonyms WHERE value = ? ORDER BY pinned DESC, id", (value,))]
+        collisions.append((value, user_ids))
+        if report_only:
+            continue
+        for user_id in user_ids[1:]:
+            attempt = db.execute("SELECT coalesce(max(attempt), 0) FROM resolutions WHERE id = ?", (user_id,)).fetchone()[0]
+            while True:
+                attempt += 1
+                new_value = pseudonym_value(str(user_id)+"#"+str(attempt), pseudonymizer.pepper)
+                if not is_taken(values, new_value) and new_value not in assigned:
+                    break
+            assigned.add(new_value)
+            db.execute("UPDATE pseudonyms SET value = ? WHERE id = ?", (new_value, user_id))
+            db.execute("INSERT INTO resolutions (id, collided_value, attempt, value) VALUES (?, ?, ?, ?)",
+                       (user_id, value, attempt, new_value))
+    if not report_only:
+        db.execute("UPDATE pseudonyms SET pinned = 1 WHERE pinned = 0")
+    db.commit()
+    return collisions
+
+
+if __name__ == "__main__":
+    import sys
+    from pseudonyms import Pseudonymizer, UserIdCollector
+    report_only = "--report" in sys.argv
+    pseudonymizer = Pseudonymizer()
+    for filename in [arg for arg in sys.argv[1:] if arg != "--report"]:
+        collector = UserIdCollector()
+        with open(filename, "rb") as infile:
+            for line in infile:
+                collector.process(json.loads(line))
+        pseudonymizer.add(sorted(collector.user_ids))
+        print(filename+":", len(collector.user_ids), "users")
+    collisions = resolve_collisions(pseudonymizer, report_only)
+    users = pseudonymizer.db.execute("SELECT count(*) FROM pseudonyms").fetchone()[0]
+    print(users, "users,", len(collisions), "collisions", "found" if report_only else "resolved")
+    for value, user_ids in collisions:
+        print(value, user_ids)
+    pseudonymizer.close()
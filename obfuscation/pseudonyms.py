@@ -0,0 +1,278 @@
+"""
+Batch user id pseudonymization
+
+The production version of user_obfuscation.py (see its docstring for the
+scheme and its caveats). A user id, prefixed with the pepper, is hashed
+with SHA3-224 and the first 61 bits of the digest give the pseudonym:
+three 12-bit indexes into the first 4096 words of the EFF long wordlist,
+then a 25-bit postfix written as 5 base 33 digits (3-Z, zero-padded with
+"3"), e.g. exceeding-cut-fascism-E5FQP.
+
+Everything is done with integer bit operations on the digest bytes, and
+the pseudonym is kept as its 61-bit value until it's written out. New ids
+are hashed in batches in a process pool, and every id -> value pair is
+kept in a sqlite cache, so reruns over the full set of users only hash
+ids they haven't seen before. The cache is tied to the pepper: opening it
+with a different one is an error, delete it to start over.
+
+Differences from the proof of concept, which follow the scheme as
+described rather than as it was coded: the postfix digits are base 33
+(the PoC divided by 26) and come from digest bits 36-60 (the PoC took
+25 characters of bin() output, "0b" prefix included), and the padding
+digit is "3", the zero of the alphabet, rather than "0".
+
+process.py runs PseudonymSink (with WRITE_PSEUDONYMS) in the same read of
+the input as the display files, writing pseudonyms_<name>.json, {user id:
+pseudonym} for every user, after resolving any collisions (see
+collisions.py). It and the cache map real user ids to their pseudonyms,
+so both go in data/ like the PoC's output, never in output/, which is
+published: opening either under output/ is an error. From the command
+line:
+    python obfuscation/pseudonyms.py 12345 67890
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+from itertools import islice
+from multiprocessing import Pool
+
+# This should be secret; set PSEUDONYM_PEPPER rather than using the default
+PEPPER = os.environ.get("PSEUDONYM_PEPPER", "gaodJx4W0neaLw5c")
+WORDLIST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "eff_large_wordlist.txt")
+CACHE_PATH = "./data/pseudonyms.sqlite"
+# the published directory, which must never hold the id -> pseudonym map
+PUBLISHED_DIR = "./output/"
+WORKERS = os.cpu_count()
+# ids looked up and hashed per batch, and per worker task
+BATCH_IDS = 100000
+TASK_IDS = 10000
+
+WORD_BITS = 12
+WORD_COUNT = 3
+POSTFIX_BITS = 25
+POSTFIX_DIGITS = 5
+PSEUDONYM_BITS = WORD_COUNT*WORD_BITS + POSTFIX_BITS
+BASE33_DIGITS = "3456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+'''
+The first 2^12 words of the EFF Diceware long list
+'''
+def load_wordlist(path=WORDLIST_PATH):
+    wordlist = []
+    with open(path, "r", encoding="UTF-8") as infile:
+        for line in islice(infile, 1 << WORD_BITS):
+            word_id, word = line.split()
+            wordlist.append(word)
+    return wordlist
+
+'''
+The 61-bit pseudonym value of a user id: the first PSEUDONYM_BITS bits of
+its peppered SHA3-224 digest
+'''
+def pseudonym_value(user_id, pepper=PEPPER):
+    digest = hashlib.sha3_224((pepper+str(user_id)).encode("UTF-8")).digest()
+    return int.from_bytes(digest[:8], "big") >> (64 - PSEUDONYM_BITS)
+
+'''
+Worker side: the pseudonym values of a list of user ids
+'''
+def pseudonym_values(task):
+    user_ids, pepper = task
+    return [pseudonym_value(user_id, pepper) for user_id in user_ids]
+
+'''
+Format a pseudonym value: three words, then the postfix in base 33
+'''
+def format_pseudonym(value, wordlist):
+    words = [wordlist[(value >> (POSTFIX_BITS + WORD_BITS*i)) & ((1 << WORD_BITS) - 1)]
+             for i in reversed(range(WORD_COUNT))]
+    postfix = value & ((1 << POSTFIX_BITS) - 1)
+    digits = []
+    for i in range(POSTFIX_DIGITS):
+        postfix, digit = divmod(postfix, len(BASE33_DIGITS))
+        digits.append(BASE33_DIGITS[digit])
+    return "-".join(words)+"-"+"".join(reversed(digits))
+
+'''
+Persistent id -> pseudonym value cache, filled in batches from a process
+pool
+'''
+class Pseudonymizer:
+    def __init__(self, cache_path=CACHE_PATH, pepper=PEPPER, workers=WORKERS, wordlist_path=WORDLIST_PATH):
+        check_private(cache_path)
+        self.pepper = pepper
+        self.workers = workers
+        self.wordlist = load_wordlist(wordlist_path)
+        self.pool = None
+        self.db = sqlite3.connect(cache_path)
+        self.db.executescript("""
+            -- pinned once checked for collisions (see collisions.py),
+            -- after which the value is never given to anyone else
+            CREATE TABLE IF NOT EXISTS pseudonyms (
+                id INTEGER PRIMARY KEY,
+                value INTEGER NOT NULL,
+                pinned INTEGER NOT NULL DEFAULT 0
+            );
+            -- every collision resolved, in order
+            CREATE TABLE IF NOT EXISTS resolutions (
+                seq INTEGER PRIMARY KEY,
+                id INTEGER NOT NULL,
+                collided_value INTEGER NOT NULL,
+                attempt INTEGER NOT NULL,
+                value INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS settings (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        # a hash of the pepper, so the pepper itself isn't written to disk
+        pepper_hash = hashlib.sha3_224(pepper.encode("UTF-8")).hexdigest()
+        self.db.execute("INSERT OR IGNORE INTO settings VALUES ('pepper', ?)", (pepper_hash,))
+        if self.db.execute("SELECT value FROM settings WHERE name = 'pepper'").fetchone()[0] != pepper_hash:
+            raise ValueError(cache_path+" was built with a different pepper, delete it to rebuild")
+
+    '''
+    Return {user id: pseudonym value} for a batch of int user ids, hashing
+    and caching the ones not in the cache
+    '''
+    def cache_batch(self, batch):
+        cached = {}
+        for i in range(0, len(batch), 500):
+            part = batch[i:i+500]
+            cached.update(self.db.execute(
+                "SELECT id, value FROM pseudonyms WHERE id IN ("+",".join("?"*len(part))+")", part))
+        new_ids = [user_id for user_id in dict.fromkeys(batch) if user_id not in cached]
+        if new_ids:
+            new_values = self.hash_ids(new_ids)
+            self.db.executemany("INSERT OR IGNORE INTO pseudonyms (id, value, pinned) VALUES (?, ?, 0)", zip(new_ids, new_values))
+            self.db.commit()
+            cached.update(zip(new_ids, new_values))
+        return cached
+
+    def iter_batches(self, user_ids):
+        user_ids = iter(user_ids)
+        batch = [int(user_id) for user_id in islice(user_ids, BATCH_IDS)]
+        while batch:
+            yield batch
+            batch = [int(user_id) for user_id in islice(user_ids, BATCH_IDS)]
+
+    '''
+    Make sure user ids are in the cache
+    '''
+    def add(self, user_ids):
+        for batch in self.iter_batches(user_ids):
+            self.cache_batch(batch)
+
+    '''
+    Yield (user id, pseudonym value) for user ids
+    '''
+    def iter_values(self, user_ids):
+        for batch in self.iter_batches(user_ids):
+            cached = self.cache_batch(batch)
+            for user_id in batch:
+                yield user_id, cached[user_id]
+
+    def hash_ids(self, user_ids):
+        if not self.workers or len(user_ids) <= TASK_IDS:
+            return pseudonym_values((user_ids, self.pepper))
+        if self.pool is None:
+            self.pool = Pool(self.workers)
+        tasks = [(user_ids[i:i+TASK_IDS], self.pepper) for i in range(0, len(user_ids), TASK_IDS)]
+        return [value for values in self.pool.map(pseudonym_values, tasks) for value in values]
+
+    '''
+    Yield (user id, pseudonym) for user ids
+    '''
+    def iter_pseudonyms(self, user_ids):
+        for user_id, value in self.iter_values(user_ids):
+            yield user_id, format_pseudonym(value, self.wordlist)
+
+    def pseudonym(self, user_id):
+        return next(self.iter_pseudonyms([user_id]))[1]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        self.db.close()
+
+'''
+Raise ValueError for a path under PUBLISHED_DIR
+'''
+def check_private(path):
+    if os.path.abspath(path).startswith(os.path.abspath(PUBLISHED_DIR)+os.sep):
+        raise ValueError(path+" is under the published "+PUBLISHED_DIR+", keep the id -> pseudonym map out of it")
+
+'''
+Pipeline sink (see process/pipeline.py): the ids of every user a tweet
+carries, its own and those of the tweets it retweets or quotes
+'''
+class UserIdCollector:
+    def __init__(self):
+        self.user_ids = set()
+
+    def decode_paths(self):
+        return [["user", "id_str"]]
+
+    def process(self, tweet):
+        self.user_ids.add(int(tweet["user"]["id_str"]))
+        if "retweeted_status" in tweet:
+            self.process(tweet["retweeted_status"])
+        if "quoted_status" in tweet:
+            self.process(tweet["quoted_status"])
+
+    def result(self):
+        return self.user_ids
+
+'''
+Collects user ids while the input is read and writes
+pseudonyms_<name>.json, ordered by id, at the end
+'''
+class PseudonymSink(UserIdCollector):
+    def __init__(self, output_filename, output_dir="./data/", cache_path=CACHE_PATH, workers=WORKERS):
+        UserIdCollector.__init__(self)
+        self.output_path = output_dir+"pseudonyms_"+output_filename+".json"
+        check_private(self.output_path)
+        check_private(cache_path)
+        self.cache_path = cache_path
+        self.workers = workers
+
+    def resume_point(self, filename, path):
+        return 0, 0
+
+    def checkpoint(self, filename, path, offset, lines, at_end=False):
+        pass
+
+    def shard_spec(self):
+        return UserIdCollector, ()
+
+    def merge(self, shard_result):
+        self.user_ids.update(shard_result)
+
+    def finish(self):
+        from collisions import resolve_collisions
+        pseudonymizer = Pseudonymizer(self.cache_path, workers=self.workers)
+        try:
+            user_ids = sorted(self.user_ids)
+            pseudonymizer.add(user_ids)
+            for value, colliding_ids in resolve_collisions(pseudonymizer):
+                print("Pseudonym collision resolved for users", colliding_ids)
+            with open(self.output_path, "w", encoding="UTF-8") as outfile:
+                separator = "{"
+                for user_id, pseudonym in pseudonymizer.iter_pseudonyms(user_ids):
+                    outfile.write(separator+json.dumps(str(user_id))+": "+json.dumps(pseudonym))
+                    separator = ", "
+                outfile.write("}" if separator == ", " else "{}")
+        finally:
+            pseudonymizer.close()
+
+
+if __name__ == "__main__":
+    import sys
+    pseudonymizer = Pseudonymizer()
+    for user_id, pseudonym in pseudonymizer.iter_pseudonyms(sys.argv[1:]):
+        print(user_id, "@"+pseudonym)
+    pseudonymizer.close()
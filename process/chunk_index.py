@@ -0,0 +1,60 @@
+"""
+Range-based id -> chunk lookup
+
+disp_twids_<name>.json / disp_userids_<name>.json map every single id to
+the chunk file holding it, which makes them tens of MB for the full
+dumps. When process.py writes its chunk files in id order (ID_RANGE_INDEX)
+each chunk covers a contiguous id range instead, and a manifest of
+[min_id, max_id, filename] triples is enough to find any id by binary
+search over the ranges.
+
+Ids are kept as strings in the manifest since tweet ids don't fit in a
+JavaScript number; compare them by length first, then lexicographically.
+
+Look up an id from the command line:
+    python process/chunk_index.py output/disp_twranges_cville814.json 896000000000000001
+"""
+
+import json
+from bisect import bisect_left
+
+'''
+Write the range manifest for (chunk, filename) pairs written in id order,
+consuming them as they come
+'''
+def write_range_manifest(written_chunks, path):
+    ranges = []
+    for chunk, chunk_fn in written_chunks:
+        ids = list(chunk)
+        ranges.append([ids[0], ids[-1], chunk_fn])
+    with open(path, "w", encoding="UTF-8") as outfile:
+        json.dump(ranges, outfile, separators=(",",":"))
+
+'''
+Load a range manifest into (min ids, max ids, filenames) lists for find_chunk
+'''
+def load_range_manifest(path):
+    with open(path, "r", encoding="UTF-8") as infile:
+        ranges = json.load(infile)
+    return ([int(min_id) for min_id, max_id, chunk_fn in ranges],
+            [int(max_id) for min_id, max_id, chunk_fn in ranges],
+            [chunk_fn for min_id, max_id, chunk_fn in ranges])
+
+'''
+Return the chunk filename that would hold id, or None if it falls outside
+every range
+'''
+def find_chunk(manifest, id):
+    min_ids, max_ids, filenames = manifest
+    id = int(id)
+    i = bisect_left(max_ids, id)
+    if i < len(max_ids) and min_ids[i] <= id:
+        return filenames[i]
+    return None
+
+
+if __name__ == "__main__":
+    import sys
+    manifest = load_range_manifest(sys.argv[1])
+    for id in sys.argv[2:]:
+        print(id, find_chunk(manifest, id))
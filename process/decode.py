@@ -0,0 +1,170 @@
+"""
+JSON line decoding
+
+json.loads builds the whole v1.1 tweet object for every line: entities,
+extended_entities, the full nested user objects, place, geo and so on,
+when the sinks only read the ~20 schema fields, the hashtags and the
+RT/QRT recursion. Each sink lists the key paths it reads (decode_paths,
+see pipeline.py) and run_pipeline builds one decoder for all of them:
+
+    orjson      builds the whole object, but in a fraction of json's time
+    simdjson    (pysimdjson) parses lazily and only the listed paths are
+                materialized into dicts, under retweeted_status and
+                quoted_status too; everything else is never built
+    json        the standard library decoder
+
+"auto" picks orjson when it's installed and json otherwise, never
+simdjson: it parses a line in a fraction of orjson's time, but the walk
+over the paths is Python, a lazy lookup per key, and costs more than
+building all of it: on the sample dump about 35-43us a line against
+orjson's 8 and json's 17-22, on tweets of several KB too. It stays
+available by name. Other
+backends can be added to DECODERS as name: factory(tree) returning a
+loads function. To check every installed decoder against json on the
+paths the sinks read, and time them:
+    python process/decode.py data/file.json
+
+The stdlib fallback can't skip anything: its C scanner always builds every
+subtree, and skipping values in Python costs more than building them, so
+without simdjson or orjson lines go through json.loads exactly as before.
+
+Lines orjson or simdjson reject and json accepts (NaN, lone surrogate
+escapes, floats out of range) are decoded by json instead, so the
+extracted records are the same whichever decoder is used. orjson reads
+integers beyond 64 bits as floats; tweet ids and counts all fit.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+# keys whose values are tweets, decoded with the same tree
+RECURSIVE_KEYS = ["retweeted_status", "quoted_status"]
+
+'''
+Build the decode tree of a list of key paths: {key: subtree, or None for the whole
+value}, with the RECURSIVE_KEYS pointing back at the tree itself
+'''
+def decode_tree(paths):
+    tree = {}
+    for key in RECURSIVE_KEYS:
+        tree[key] = tree
+    for path in paths:
+        node = tree
+        for key in path[:-1]:
+            if key not in node:
+                node[key] = {}
+            node = node[key]
+            if node is None:
+                break
+        else:
+            # a whole value wins over any of its paths, but a tweet stays a tweet
+            if node.get(path[-1]) is not tree:
+                node[path[-1]] = None
+    return tree
+
+def json_decoder(tree):
+    return json.loads
+
+def orjson_decoder(tree):
+    def loads(line):
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            return json.loads(line)
+    return loads
+
+'''
+Materialize the paths of tree from a lazy simdjson object
+'''
+def project(value, tree):
+    record = {}
+    for key, subtree in tree.items():
+        if key in value:
+            item = value[key]
+            if isinstance(item, simdjson.Object):
+                item = item.as_dict() if subtree is None else project(item, subtree)
+            elif isinstance(item, simdjson.Array):
+                item = item.as_list()
+            record[key] = item
+    return record
+
+def simdjson_decoder(tree):
+    # a parser holds one document at a time; every line is projected into
+    # plain dicts before the next one is parsed. No tree decodes everything.
+    parser = simdjson.Parser()
+    def loads(line):
+        try:
+            document = parser.parse(line)
+        except ValueError:
+            return json.loads(line)
+        if not isinstance(document, simdjson.Object):
+            return document
+        if tree is None:
+            return document.as_dict()
+        return project(document, tree)
+    return loads
+
+DECODERS = {"orjson":orjson_decoder, "simdjson":simdjson_decoder, "json":json_decoder}
+INSTALLED = {"orjson":orjson is not None, "simdjson":simdjson is not None, "json":True}
+# "auto", fastest first; simdjson is slower than json here (see above)
+AUTO_ORDER = ["orjson", "json"]
+
+'''
+The paths of tree in a decoded value, like project does for simdjson
+'''
+def select(value, tree):
+    record = {}
+    for key, subtree in tree.items():
+        if key in value:
+            item = value[key]
+            if subtree is not None and isinstance(item, dict):
+                item = select(item, subtree)
+            record[key] = item
+    return record
+
+'''
+Return a loads function for the named decoder ("auto" for the first
+installed of AUTO_ORDER) that decodes at least paths, or everything when paths is None
+'''
+def make_decoder(name="auto", paths=None):
+    if name == "auto":
+        name = next(decoder for decoder in AUTO_ORDER if INSTALLED.get(decoder, True))
+    if name not in DECODERS:
+        raise ValueError("unknown decoder: "+name)
+    if not INSTALLED.get(name, True):
+        raise ValueError(name+" is not installed")
+    return DECODERS[name](None if paths is None else decode_tree(paths))
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from process import TWEET_SCHEMA, USER_SCHEMA, USER_SIZE_BOUNDS, TZ_OFFSET
+    from display import DisplayExtractor
+
+    paths = DisplayExtractor(TWEET_SCHEMA, USER_SCHEMA, USER_SIZE_BOUNDS, TZ_OFFSET).decode_paths()
+    tree = decode_tree(paths)
+    with open(sys.argv[1],"rb") as infile:
+        lines = [line for line, _ in zip(infile, range(20000))]
+    # compared as JSON, where NaN equals itself
+    expected = [json.dumps(select(json.loads(line), tree)) for line in lines]
+    for name in DECODERS:
+        if not INSTALLED[name]:
+            print(name+": not installed")
+            continue
+        loads = make_decoder(name, paths)
+        start = time.perf_counter()
+        for line in lines:
+            loads(line)
+        seconds = time.perf_counter() - start
+        mismatches = sum(json.dumps(select(loads(line), tree)) != line_expected for line, line_expected in zip(lines, expected))
+        print(name+":", round(seconds/len(lines)*1e6, 1), "us/line,", mismatches, "of", len(lines), "lines differ")
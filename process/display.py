@@ -0,0 +1,546 @@
+"""
+Display file builder
+
+Pipeline sink (see pipeline.py) behind process.py: extracts display
+tweets and users from each tweet into a store (see store.py) and, once
+every input is read, writes the chunked display files, id lookups and
+sort lists the viewer loads.
+
+Display tweets are first-seen; retweets are never kept as display tweets,
+only appended to their parent's retweets as (user_id, screen_name,
+created_at), and a QRT is counted on its parent the first time it's seen.
+Users are last-seen but keep their first-seen position.
+
+For static hosting, chunk files can be written with compact separators
+and with pre-compressed .gz (and .br, if the brotli module is installed)
+siblings, so the host doesn't compress them on every request. Chunks can
+also be cut at a target compressed size rather than every box_size
+records: a chunk holding viral tweets with huge retweet lists then simply
+holds fewer tweets. The size is estimated with a level 9 zlib stream,
+like the .gz itself (see GzipSizeEstimate), and lands within a few
+percent under the target. Sort list positions still count records, so
+with sized chunks a disp_twchunks_/disp_uchunks_ file lists the position
+each chunk starts at.
+"""
+
+import json
+import gzip
+import time
+import zlib
+import itertools
+from array import array
+
+from schema import compile_schema
+from twitter_time import parse_created_at, parse_account_created_at
+from store import MemoryStore, iter_batches
+from sort_lists import SORT_ORDERS, sort_columns, sort_permutations, iter_sorted_ids, chunk_positions, write_index_file
+from sort_lists import write_sort_pages, top_ids, subset_columns
+from chunk_index import write_range_manifest
+from record_file import write_record_file
+from metrics import NULL_METRICS
+import incremental
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# uncompressed bytes between the flushes of a chunk size estimate
+SIZE_FLUSH_BYTES = 1 << 14
+
+'''
+Extraction shared by the sink and its parallel shards: schemas compiled
+once into unrolled extractor functions (see schema.py)
+'''
+class DisplayExtractor:
+    def __init__(self, tweet_schema, user_schema, user_size_bounds, tz_offset):
+        self.extractor_args = (tweet_schema, user_schema, user_size_bounds, tz_offset)
+        self.extract_tweet_fields = compile_schema(tweet_schema, drop_falsy=True, name="extract_tweet_fields")
+        self.extract_user_fields = compile_schema(user_schema, drop_falsy=False, name="extract_user_fields")
+        self.user_size_bounds = user_size_bounds
+        self.tz_offset = tz_offset
+        # per instance, so a sink's metrics can time them (see metrics.py)
+        self.parse_created_at = parse_created_at
+        self.parse_account_created_at = parse_account_created_at
+
+    '''
+    The key paths read from a tweet (see decode.py)
+    '''
+    def decode_paths(self):
+        tweet_schema, user_schema = self.extractor_args[:2]
+        return (list(tweet_schema.values()) + [["user"]+path for path in user_schema.values()]
+                + [["id_str"], ["user", "id_str"], ["entities", "hashtags"]])
+
+    '''
+    follow the schema to extract the attributes for a single display tweet
+    '''
+    def extract_display_tweet(self, tweet):
+        return self.extract_tweet_fields(tweet)
+
+    '''
+    follow the schema to extract the attributes for a single display user.
+    seen_user is the display user already extracted for the same id, if any:
+    account creation time never changes, so its parsed created_at fields are
+    reused instead of parsing them again.
+    '''
+    def extract_display_user(self, tweet, seen_user=None):
+        display_user = self.extract_user_fields(tweet["user"])
+        # construct search fields (0 is smallest)
+        if not display_user["followers_count"]:
+            display_user["followers_count"] = 0
+        display_user["size"] = len(self.user_size_bounds)
+        for size in reversed(range(len(self.user_size_bounds))):
+            if int(display_user["followers_count"]) < self.user_size_bounds[size]:
+                display_user["size"] = size
+
+        # created_at fields
+        if seen_user is not None:
+            display_user["created_at"] = seen_user["created_at"]
+            display_user["created_year"] = seen_user["created_year"]
+            return display_user
+        display_user["created_at"], display_user["created_year"] = self.parse_account_created_at(display_user["created_at"])
+        return display_user
+
+    '''
+    Walk a tweet and all upstream RT/QRT once, extracting display tweets and
+    users together. Tweets already in the store are skipped before any
+    extraction work; new ones are added to extracted_tweets in the same
+    twid:display_tweet order the old recursive extractor returned. Users are
+    written straight into the store, last-seen like before.
+    '''
+    def extract_display_records(self, tweet, store, extracted_tweets):
+        twid = tweet["id_str"]
+        if not store.has_tweet(twid):
+            display_tweet = self.extract_display_tweet(tweet)
+            # special hashtag processing (first-seen order keeps output reproducible)
+            display_hashtags = {}
+            for hashtag in tweet["entities"]["hashtags"]:
+                display_hashtags[hashtag["text"].lower()] = None
+            display_tweet["hashtags"] = list(display_hashtags)
+            extracted_tweets[twid] = display_tweet
+
+        userid = tweet["user"]["id_str"]
+        store.put_user(userid, self.extract_display_user(tweet, store.get_user(userid)))
+
+        if "retweeted_status" in tweet:
+            self.extract_display_records(tweet["retweeted_status"], store, extracted_tweets)
+        if "quoted_status" in tweet:
+            self.extract_display_records(tweet["quoted_status"], store, extracted_tweets)
+        return extracted_tweets
+
+    '''
+    Fold a single parsed tweet into the store
+    '''
+    def process_tweet(self, tweet, store):
+        # extract display tweets not already extracted, updating users on the way
+        extracted_tweets = self.extract_display_records(tweet, store, {})
+
+        # convert datetime string to unix epoch (memoized, see twitter_time.py)
+        for twid,extracted_tweet in extracted_tweets.items():
+            extracted_tweet["created_at"], extracted_tweet["local_date"] = self.parse_created_at(extracted_tweet["created_at"], self.tz_offset)
+            # retweets are never kept as display tweets, only appended to their parent
+            if "retweeted_status_id" not in extracted_tweet:
+                store.add_tweet(twid, extracted_tweet)
+
+        # append retweet and quote retweet info to parents
+        for extracted_tweet in extracted_tweets.values():
+            if "retweeted_status_id" in extracted_tweet:
+                store.append_retweets(extracted_tweet["retweeted_status_id"], [(extracted_tweet["user_id"],extracted_tweet["user_screen_name"],extracted_tweet["created_at"])])
+            elif "quoted_status_id" in extracted_tweet:
+                store.add_quote_retweets(str(extracted_tweet["quoted_status_id"]), [extracted_tweet["id"]])
+
+'''
+Worker side of sharded ingestion: the serial per-tweet logic over one byte
+range, into a shard-local MemoryStore. The result also carries the
+created_at cache's hits and misses in the shard, since the worker's cache
+isn't the one the parent's metrics see.
+'''
+class DisplayShard(DisplayExtractor):
+    def __init__(self, *extractor_args):
+        DisplayExtractor.__init__(self, *extractor_args)
+        self.store = MemoryStore()
+        self.cache_start = parse_created_at.cache_info()
+
+    def process(self, tweet):
+        self.process_tweet(tweet, self.store)
+
+    def result(self):
+        cache_info = parse_created_at.cache_info()
+        cache_counts = (cache_info.hits-self.cache_start.hits, cache_info.misses-self.cache_start.misses, cache_info.currsize)
+        return self.store.tweets, self.store.users, dict(self.store.quote_retweets), cache_counts
+
+'''
+Stream (key, value) string pairs to outfile as a JSON object, formatted
+exactly like json.dump, without building the dictionary first
+'''
+def dump_json_pairs(pairs, outfile):
+    outfile.write("{")
+    separator = ""
+    for key, value in pairs:
+        outfile.write(separator+json.dumps(key)+": "+json.dumps(value))
+        separator = ", "
+    outfile.write("}")
+
+'''
+Stream strings to outfile as a JSON array, formatted exactly like json.dump
+'''
+def dump_json_list(items, outfile):
+    outfile.write("[")
+    separator = ""
+    for item in items:
+        outfile.write(separator+json.dumps(item))
+        separator = ", "
+    outfile.write("]")
+
+'''
+Running estimate of a chunk's gzipped size as records are added. Flushing
+the stream is what makes its output size known, but every flush ends a
+deflate block and restarts matching, so it's only done every
+SIZE_FLUSH_BYTES; the bytes since are counted at the ratio so far.
+'''
+class GzipSizeEstimate:
+    def __init__(self):
+        self.compressor = zlib.compressobj(9)
+        self.compressed = 0
+        self.flushed_bytes = 0
+        self.pending_bytes = 0
+
+    def add(self, data):
+        self.compressed += len(self.compressor.compress(data))
+        self.pending_bytes += len(data)
+        if self.pending_bytes >= SIZE_FLUSH_BYTES:
+            self.compressed += len(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+            self.flushed_bytes += self.pending_bytes
+            self.pending_bytes = 0
+
+    def size(self):
+        if not self.flushed_bytes:
+            # nothing flushed yet: assume a typical ratio for JSON
+            return self.pending_bytes//4
+        return self.compressed + self.pending_bytes*self.compressed//self.flushed_bytes
+
+'''
+Write every chunk of written_chunks (see DisplaySink.write_chunk_files),
+returning (ids, filename) for each, the ids packed into an array("Q") so
+the id lookups don't keep the chunks or millions of id strings around
+'''
+def written_ids(written_chunks):
+    return [(array("Q", map(int, chunk)), chunk_fn) for chunk, chunk_fn in written_chunks]
+
+'''
+The display file sink. Options mirror the process.py settings of the same
+names: with id_range_index chunks are written in id order with a range
+manifest, sort_format picks "json", "binary" or "both" sort lists,
+sort_page_size / sort_top_n add sort pages and top files, compact_json,
+precompress and chunk_target_bytes shape the chunk files, partition_by
+("date" or "hour") splits the tweet output by local time, record_file
+also writes the mmap-able record file (see record_file.py), incremental
+keeps state between runs in the store (see incremental.py) and metrics
+times the sink's stages (see metrics.py).
+'''
+class DisplaySink(DisplayExtractor):
+    def __init__(self, store, tweet_schema, user_schema, user_size_bounds, tz_offset, output_filename,
+                 box_size=2000, output_dir="./output/", id_range_index=False, sort_format="json",
+                 sort_page_size=0, sort_top_n=0, compact_json=False, precompress=False, chunk_target_bytes=0,
+                 partition_by=None, record_file=False, incremental=False, manifest_path=None, metrics=NULL_METRICS):
+        DisplayExtractor.__init__(self, tweet_schema, user_schema, user_size_bounds, tz_offset)
+        if incremental and id_range_index:
+            raise ValueError("incremental runs rewrite insertion-ordered chunks, turn off the id range index")
+        if incremental and chunk_target_bytes:
+            raise ValueError("incremental runs need fixed-size chunks, turn off the chunk target size")
+        if incremental and partition_by:
+            raise ValueError("incremental runs rewrite insertion-ordered chunks, turn off partitioning")
+        if partition_by not in [None, "date", "hour"]:
+            raise ValueError("unknown partition: "+str(partition_by))
+        self.store = store
+        self.output_filename = output_filename
+        self.box_size = box_size
+        self.output_dir = output_dir
+        self.id_range_index = id_range_index
+        self.sort_format = sort_format
+        self.sort_page_size = sort_page_size
+        self.sort_top_n = sort_top_n
+        self.separators = (",", ":") if compact_json else None
+        self.precompress = precompress
+        self.chunk_target_bytes = chunk_target_bytes
+        self.partition_by = partition_by
+        self.record_file = record_file
+        self.incremental = incremental
+        self.manifest_path = manifest_path
+        self.metrics = metrics
+        # created_at cache (hits, misses, size) of every merged shard
+        self.shard_cache_counts = []
+        metrics.instrument(self, ["process"], "extract")
+        metrics.instrument(self, ["parse_created_at", "parse_account_created_at"], "timestamps")
+        metrics.instrument(store, ["has_tweet", "add_tweet", "get_user", "put_user", "append_retweets", "add_quote_retweets"], "dedupe")
+        metrics.instrument(self, ["write_chunk"], "write_chunks")
+        metrics.instrument(self, ["write_id_lookup"], "index")
+        metrics.instrument(self, ["write_sort_lists", "write_top_file"], "sort")
+
+    def resume_point(self, filename, path):
+        if self.incremental:
+            return incremental.resume_point(self.store, filename, path)
+        return 0, 0
+
+    def process(self, tweet):
+        self.process_tweet(tweet, self.store)
+
+    def checkpoint(self, filename, path, offset, lines, at_end=False):
+        # the consumed offset is committed together with the records
+        if self.incremental:
+            incremental.record_input(self.store, filename, path, offset, lines, at_end)
+        self.store.flush()
+
+    def shard_spec(self):
+        return DisplayShard, self.extractor_args
+
+    '''
+    Merge one shard into the store. Shards must be merged in input order so
+    the result matches a serial run: tweets stay first-seen, retweets land on
+    the first-seen parent, a QRT is only counted the first time it is seen and
+    users are last-seen.
+    '''
+    def merge(self, shard_result):
+        shard_tweets, shard_users, shard_quote_retweets, cache_counts = shard_result
+        self.shard_cache_counts.append(cache_counts)
+        store = self.store
+        for parent_id, qrt_ids in shard_quote_retweets.items():
+            new_qrt_ids = [qrt_id for qrt_id in qrt_ids if not store.has_tweet(qrt_id)]
+            if new_qrt_ids:
+                store.add_quote_retweets(parent_id, new_qrt_ids)
+        for twid, shard_tweet in shard_tweets.items():
+            if not store.has_tweet(twid):
+                store.add_tweet(twid, shard_tweet)
+            elif "retweets" in shard_tweet:
+                store.append_retweets(twid, shard_tweet["retweets"])
+        for userid, shard_user in shard_users.items():
+            store.put_user(userid, shard_user)
+
+    def finish(self):
+        self.metrics.cache("parse_created_at", parse_created_at, self.shard_cache_counts)
+        if self.incremental:
+            self.write_display_files(*self.changed_chunk_indexes())
+            self.store.clear_changes()
+            incremental.write_manifest(self.manifest_path, self.store, self.box_size)
+        else:
+            self.write_display_files()
+        self.store.close()
+
+    def chunk_filename(self, prefix, file_count, name=None):
+        return prefix+(name or self.output_filename)+"-"+str(file_count).zfill(3)+".json"
+
+    '''
+    Write each chunk to its own file, yielding (chunk, filename) pairs as they
+    are written. chunk_indexes are the file numbers of the
+    chunks when only some of them are rewritten; name replaces the output
+    filename for partitions.
+    '''
+    def write_chunk_files(self, chunks, prefix, label, total, chunk_indexes=None, name=None):
+        file_counts = range(total//self.box_size+1) if chunk_indexes is None else sorted(chunk_indexes)
+        if self.chunk_target_bytes:
+            chunks = self.metrics.timed_iter("write_chunks", self.sized_chunks(chunks))
+            file_counts = itertools.count()
+            chunk_starts = []
+            start = 0
+        for file_count, chunk in zip(file_counts, chunks):
+            if self.chunk_target_bytes:
+                print("Writing "+label+" file",file_count)
+                chunk_starts.append(start)
+                start += len(chunk)
+            else:
+                print("Writing "+label+" file",str(file_count)+"/"+str(int(total/self.box_size)))
+            print("  (",len(chunk),label+"s )")
+            chunk_fn = self.chunk_filename(prefix, file_count, name)
+            self.write_chunk(chunk_fn, chunk)
+            yield chunk, chunk_fn
+        if self.chunk_target_bytes:
+            with open(self.output_dir+prefix[:-1]+"chunks_"+(name or self.output_filename)+".json", "w", encoding="UTF-8") as outfile:
+                json.dump(chunk_starts, outfile)
+
+    def write_chunk(self, chunk_fn, chunk):
+        data = json.dumps(chunk, separators=self.separators).encode("UTF-8")
+        with open(self.output_dir+chunk_fn, "wb") as outfile:
+            outfile.write(data)
+        if self.precompress:
+            # mtime=0 keeps the .gz files reproducible
+            with open(self.output_dir+chunk_fn+".gz", "wb") as outfile:
+                outfile.write(gzip.compress(data, 9, mtime=0))
+            if brotli is not None:
+                with open(self.output_dir+chunk_fn+".br", "wb") as outfile:
+                    outfile.write(brotli.compress(data))
+
+    '''
+    Re-cut chunks so each holds about chunk_target_bytes of compressed JSON,
+    and no more than box_size records. A record that alone is over the
+    target gets a chunk to itself.
+    '''
+    def sized_chunks(self, chunks):
+        key_separator = ": " if self.separators is None else ":"
+        chunk = {}
+        for key, record in (item for fixed_chunk in chunks for item in fixed_chunk.items()):
+            piece = (json.dumps(key)+key_separator+json.dumps(record, separators=self.separators)).encode("UTF-8")
+            if not chunk:
+                estimate = GzipSizeEstimate()
+            estimate.add(piece)
+            if chunk and (estimate.size() > self.chunk_target_bytes or len(chunk) >= self.box_size):
+                yield chunk
+                chunk = {}
+                estimate = GzipSizeEstimate()
+                estimate.add(piece)
+            chunk[key] = record
+        if chunk:
+            yield chunk
+
+    '''
+    Write the id lookup for written chunks: a (min_id, max_id) range manifest
+    when the chunks are in id order, otherwise an id:filename map.
+    written_chunks are (ids, filename) pairs (see written_ids); when only
+    some chunks were rewritten, the map's (id, filename) pairs are passed in.
+    '''
+    def write_id_lookup(self, written_chunks, map_prefix, ranges_prefix, pairs=None, name=None):
+        name = name or self.output_filename
+        if self.id_range_index:
+            write_range_manifest(((map(str, ids), chunk_fn) for ids, chunk_fn in written_chunks),
+                                 self.output_dir+ranges_prefix+name+".json")
+            return
+        if pairs is None:
+            pairs = ((str(key),chunk_fn) for ids,chunk_fn in written_chunks for key in ids)
+        with open(self.output_dir+map_prefix+name+".json", "w", encoding="UTF-8") as outfile:
+            dump_json_pairs(pairs, outfile)
+
+    '''
+    (id, filename) pairs for every id in insertion-ordered chunks
+    '''
+    def chunk_lookup_pairs(self, ids, prefix):
+        return ((key,self.chunk_filename(prefix, i//self.box_size)) for i,key in enumerate(ids))
+
+    '''
+    Write a top_<order>_ file: the first sort_top_n ids of the order with their
+    display tweets and users. The retweet and quote retweet id lists are left
+    in the chunk files, since the most retweeted tweets carry huge ones.
+    '''
+    def write_top_file(self, order, ids):
+        top_tweets = {}
+        for twid, tweet in self.store.get_tweets(ids).items():
+            top_tweets[twid] = {k:v for k,v in tweet.items() if k not in ["retweets", "quote_retweets"]}
+        top_users = {tweet["user_id"]:self.store.get_user(tweet["user_id"]) for tweet in top_tweets.values()}
+        with open(self.output_dir+"top_"+order+"_"+self.output_filename+".json", "w", encoding="UTF-8") as outfile:
+            json.dump({"ids":ids, "tweets":{twid:top_tweets[twid] for twid in ids}, "users":top_users}, outfile)
+
+    '''
+    Write the sort lists (and pages) of every order for the tweets in columns
+    '''
+    def write_sort_lists(self, columns, permutations, name):
+        pages = {}
+        for order in SORT_ORDERS:
+            if self.sort_format in ["json", "both"]:
+                with open(self.output_dir+"sort_"+order+"_"+name+".json", "w", encoding="UTF-8") as outfile:
+                    dump_json_list(iter_sorted_ids(columns, permutations[order]), outfile)
+            if self.sort_format in ["binary", "both"]:
+                write_index_file(chunk_positions(permutations, order, self.id_range_index), self.output_dir+"sort_"+order+"_"+name+".bin")
+            if self.sort_page_size:
+                pages[order] = write_sort_pages(columns, permutations, order, self.sort_page_size, self.output_dir, "sort_"+order+"_"+name)
+        if self.sort_page_size:
+            with open(self.output_dir+"sort_pages_"+name+".json", "w", encoding="UTF-8") as outfile:
+                json.dump({"page_size":self.sort_page_size, "total":len(columns["id"]), "orders":pages}, outfile)
+
+    '''
+    The partition label of a tweet created_at epoch: its local date, plus
+    the local hour when partitioning by hour
+    '''
+    def partition_label(self, created_at):
+        local_time = time.gmtime(created_at + self.tz_offset*3600)
+        if self.partition_by == "hour":
+            return time.strftime("%Y-%m-%dT%H", local_time)
+        return time.strftime("%Y-%m-%d", local_time)
+
+    '''
+    Time-partitioned tweet output: for every local date (or hour) its own
+    chunk files, id lookup and sort lists, all named <output>_<partition>,
+    and partitions_<output>.json listing the partitions
+    '''
+    def write_partitions(self, columns):
+        partitions = {}
+        for position, created_at in enumerate(columns["created_at"]):
+            partitions.setdefault(self.partition_label(created_at), []).append(position)
+
+        manifest = []
+        for label in sorted(partitions):
+            name = self.output_filename+"_"+label
+            part_columns = subset_columns(columns, partitions[label])
+            permutations = sort_permutations(part_columns)
+            twids = list(iter_sorted_ids(part_columns, permutations["chrono"] if self.id_range_index else range(len(part_columns["id"]))))
+            tweet_chunks = self.metrics.timed_iter("store_read",
+                                                   ({twid:tweets[twid] for twid in chunk_ids}
+                                                    for chunk_ids in iter_batches(twids, self.box_size)
+                                                    for tweets in [self.store.get_tweets(chunk_ids)]))
+            written_tweets = written_ids(self.write_chunk_files(tweet_chunks, "disp_tw_", "tweet", len(twids), name=name))
+            self.write_id_lookup(written_tweets, "disp_twids_", "disp_twranges_", name=name)
+            self.write_sort_lists(part_columns, permutations, name)
+            manifest.append({
+                "partition":label,
+                "name":name,
+                "tweets":len(twids),
+                "min_id":str(min(part_columns["id"])),
+                "max_id":str(max(part_columns["id"])),
+            })
+        with open(self.output_dir+"partitions_"+self.output_filename+".json", "w", encoding="UTF-8") as outfile:
+            json.dump({"partition_by":self.partition_by, "tz_offset":self.tz_offset, "partitions":manifest}, outfile)
+
+    '''
+    Write the tweet/user chunk files, id lookups and sort lists. With
+    tweet_chunk_indexes / user_chunk_indexes only those insertion-ordered
+    chunk files are rewritten; the id lookups and sort lists always are.
+    '''
+    def write_display_files(self, tweet_chunk_indexes=None, user_chunk_indexes=None):
+        store = self.store
+        tweet_count = store.tweet_count()
+        user_count = store.user_count()
+        self.metrics.gauge("tweets", tweet_count)
+        self.metrics.gauge("users", user_count)
+
+        # sort orders come from one pass over the sort keys (see sort_lists.py)
+        with self.metrics.stage("sort"):
+            columns = sort_columns(store.iter_sort_keys())
+            permutations = sort_permutations(columns)
+
+        if self.partition_by:
+            self.write_partitions(columns)
+        else:
+            tweet_chunks = self.metrics.timed_iter("store_read",
+                store.iter_tweet_chunks(self.box_size, by_id=self.id_range_index, chunk_indexes=tweet_chunk_indexes))
+            tweet_pairs = None
+            if tweet_chunk_indexes is not None:
+                tweet_pairs = self.chunk_lookup_pairs(store.iter_ids("tweets"), "disp_tw_")
+            written_tweets = written_ids(self.write_chunk_files(tweet_chunks, "disp_tw_", "tweet", tweet_count, tweet_chunk_indexes))
+            self.write_id_lookup(written_tweets, "disp_twids_", "disp_twranges_", tweet_pairs)
+
+            # create sort lists
+            self.write_sort_lists(columns, permutations, self.output_filename)
+
+        user_chunks = self.metrics.timed_iter("store_read",
+            store.iter_user_chunks(self.box_size, by_id=self.id_range_index, chunk_indexes=user_chunk_indexes))
+        user_pairs = None
+        if user_chunk_indexes is not None:
+            user_pairs = self.chunk_lookup_pairs(store.iter_ids("users"), "disp_u_")
+        written_users = written_ids(self.write_chunk_files(user_chunks, "disp_u_", "user", user_count, user_chunk_indexes))
+        self.write_id_lookup(written_users, "disp_userids_", "disp_uranges_", user_pairs)
+
+        if self.sort_top_n:
+            for order in SORT_ORDERS:
+                self.write_top_file(order, top_ids(columns, permutations, order, self.sort_top_n))
+
+        if self.record_file:
+            with self.metrics.stage("records"):
+                write_record_file(store.iter_tweet_chunks(self.box_size), store.iter_user_chunks(self.box_size),
+                                  permutations, self.output_dir+"records_"+self.output_filename)
+
+    '''
+    Incremental runs: the chunk indexes to rewrite for tweets and users, None
+    for all of them when there's no manifest from a run with the same layout
+    '''
+    def changed_chunk_indexes(self):
+        manifest = incremental.load_manifest(self.manifest_path)
+        if manifest is None or manifest["box_size"] != self.box_size:
+            return None, None
+        return self.store.changed_chunks("tweets", self.box_size), self.store.changed_chunks("users", self.box_size)
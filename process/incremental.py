@@ -0,0 +1,138 @@
+"""
+Incremental processing state
+
+With INCREMENTAL set, process.py keeps its display records in the sqlite
+store between runs and only reads input it hasn't consumed yet: a new
+daily dump in DATA_FILES, or lines appended to one already read. The
+store's inputs table records, for every input file, the byte offset and
+line count consumed so far together with a fingerprint of the bytes up
+to that offset, in the same transaction as the records read from them.
+A file whose consumed part no longer matches its fingerprint was
+rewritten, and merging it again would double count its retweets and
+QRTs, so that stops the run instead. The offset is recorded at every
+checkpoint, but a file's first bytes are hashed once per run.
+
+A file read to its end is skipped while it stays unchanged. For plain
+files that is an offset equal to the file size. The offsets of
+compressed files count decompressed bytes, so those also get an end
+fingerprint once read to the end: their size on disk and the first and
+last FINGERPRINT_BYTES of the compressed bytes. A compressed file that
+still matches it isn't decompressed again.
+
+The store also tracks the tweets and users touched since the output was
+last written, so only the chunk files holding them are rewritten. The
+sort lists are always rewritten, since new tweets move every order.
+
+After each run the manifest (output/manifest_<name>.json) records the
+inputs and the chunk layout the output was written with; a missing
+manifest or a different BOX_SIZE rewrites every chunk.
+"""
+
+import os
+import json
+import hashlib
+
+from pipeline import open_input, is_compressed
+
+# bytes hashed at the start of a file and before the consumed offset
+FINGERPRINT_BYTES = 1 << 20
+
+# the hash of each input's first bytes, by path, so the checkpoints of a
+# run don't hash them again (see head_hash)
+head_hashes = {}
+
+'''
+A sha256 of the first length (decompressed) bytes of a file, hashed once
+and copied for every later call while the file is unchanged on disk
+'''
+def head_hash(path, length):
+    stat = os.stat(path)
+    key = (length, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    if path not in head_hashes or head_hashes[path][0] != key:
+        with open_input(path) as infile:
+            head_hashes[path] = key, hashlib.sha256(infile.read(length))
+    return head_hashes[path][1].copy()
+
+'''
+Fingerprint the first offset bytes of a file: its first and last
+FINGERPRINT_BYTES. Dumps are only ever appended to, so this is enough to
+tell a grown file from a replaced one without hashing all of it.
+Compressed files are fingerprinted on their first decompressed bytes
+only, since reaching the tail means decompressing everything before it.
+The first bytes are only hashed once per file (see head_hash), so a
+checkpoint reads at most the FINGERPRINT_BYTES before the offset.
+'''
+def fingerprint(path, offset):
+    digest = head_hash(path, min(offset, FINGERPRINT_BYTES))
+    if not is_compressed(path):
+        tail_start = max(offset-FINGERPRINT_BYTES, FINGERPRINT_BYTES)
+        if tail_start < offset:
+            with open(path, "rb") as infile:
+                infile.seek(tail_start)
+                digest.update(infile.read(offset-tail_start))
+    digest.update(str(offset).encode())
+    return digest.hexdigest()
+
+'''
+Fingerprint a compressed file as stored: its size and its first and last
+FINGERPRINT_BYTES, read without decompressing anything
+'''
+def end_fingerprint(path):
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as infile:
+        digest.update(infile.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            infile.seek(max(size-FINGERPRINT_BYTES, FINGERPRINT_BYTES))
+            digest.update(infile.read())
+    return digest.hexdigest()
+
+'''
+Return (offset, lines) already consumed from an input file, (0, 0) for a
+new one, or None for one read to its end and unchanged since. Raises
+ValueError if the consumed part of the file has changed.
+'''
+def resume_point(store, filename, path):
+    consumed = store.get_input(filename)
+    if consumed is None:
+        if store.tweet_count() and next(iter(store.iter_inputs()), None) is None:
+            raise ValueError("the store wasn't built incrementally, delete it to rebuild with INCREMENTAL")
+        return 0, 0
+    size, file_fingerprint, offset, lines, file_end_fingerprint = consumed
+    if is_compressed(path):
+        if file_end_fingerprint is not None and file_end_fingerprint == end_fingerprint(path):
+            return None
+    elif os.path.getsize(path) < offset:
+        raise ValueError(filename+" changed since it was processed, rebuild without INCREMENTAL")
+    if fingerprint(path, offset) != file_fingerprint:
+        raise ValueError(filename+" changed since it was processed, rebuild without INCREMENTAL")
+    if not is_compressed(path) and offset == os.path.getsize(path):
+        return None
+    return offset, lines
+
+'''
+Record how far an input file has been consumed, at_end once it was read
+to the end. Call before the store's flush so the offset is committed
+together with the records.
+'''
+def record_input(store, filename, path, offset, lines, at_end=False):
+    file_end_fingerprint = end_fingerprint(path) if at_end and is_compressed(path) else None
+    store.set_input(filename, os.path.getsize(path), fingerprint(path, offset), offset, lines, file_end_fingerprint)
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="UTF-8") as infile:
+        return json.load(infile)
+
+def write_manifest(path, store, box_size):
+    manifest = {
+        "box_size":box_size,
+        "tweet_count":store.tweet_count(),
+        "user_count":store.user_count(),
+        "inputs":{filename:{"size":size, "fingerprint":file_fingerprint, "offset":offset, "lines":lines,
+                            "end_fingerprint":file_end_fingerprint}
+                  for filename, size, file_fingerprint, offset, lines, file_end_fingerprint in store.iter_inputs()},
+    }
+    with open(path, "w", encoding="UTF-8") as outfile:
+        json.dump(manifest, outfile, indent=1)
@@ -0,0 +1,191 @@
+"""
+Run metrics
+
+process.py can write a JSON metrics file at the end of a run (METRICS_PATH)
+with, for every stage of the run, the wall and CPU time spent in it and
+the number of times it was entered:
+
+    read            reading (and decompressing) input lines
+    parse           JSON decoding of every line (see decode.py)
+    extract         walking each tweet into display tweets and users
+    dedupe          store lookups and inserts: first-seen tweets,
+                    last-seen users, retweet and quote retweet lists
+    timestamps      created_at conversion
+    workers         waiting on worker processes (parallel runs, where the
+                    per-line stages above run in the workers, unmeasured)
+    merge           folding worker results in
+    checkpoint      sink checkpoints (sqlite commits, incremental state)
+    store_read      building chunks from the store
+    write_chunks    serializing and writing chunk files
+    sort            sort columns, orders, sort lists and top files
+    index           id lookup and range files
+    records         the record file (see record_file.py)
+    finish          the rest of writing the outputs
+    other           anything outside a stage
+
+Times are exclusive: time in a stage entered from another one only counts
+for the inner stage, so the stages add up to the run. The file also gets
+the lines read and lines/s, peak RSS, store sizes and the hit rates of the
+created_at caches, the workers' included in parallel runs.
+
+Per-line stages are timed by wrapping the functions involved, and only
+when metrics are on: NULL_METRICS, used otherwise, hands the functions
+back unwrapped. Timing them costs a few microseconds a line.
+
+PROFILE_STAGE names one stage to run under cProfile; its profile is
+written next to the metrics file (<METRICS_PATH>.prof, read it with
+python -m pstats).
+"""
+
+import json
+import time
+import cProfile
+import resource
+from contextlib import contextmanager, nullcontext
+
+class Metrics:
+    def __init__(self, profile_stage=None):
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+        self.caches = {}
+        self.stack = []
+        self.profile_stage = profile_stage
+        self.profiler = cProfile.Profile() if profile_stage else None
+        self.start_wall = self.wall = time.perf_counter()
+        self.start_cpu = self.cpu = time.process_time()
+
+    '''
+    Charge the time since the last switch to the current stage
+    '''
+    def switch(self):
+        wall, cpu = time.perf_counter(), time.process_time()
+        stage = self.stages.setdefault(self.stack[-1] if self.stack else "other", [0.0, 0.0, 0])
+        stage[0] += wall - self.wall
+        stage[1] += cpu - self.cpu
+        self.wall, self.cpu = wall, cpu
+
+    def enter(self, name):
+        self.switch()
+        self.stages.setdefault(name, [0.0, 0.0, 0])[2] += 1
+        self.stack.append(name)
+        if name == self.profile_stage:
+            self.profiler.enable()
+
+    def exit(self):
+        self.switch()
+        if self.stack.pop() == self.profile_stage:
+            self.profiler.disable()
+
+    @contextmanager
+    def stage(self, name):
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    '''
+    Return func timed as stage name
+    '''
+    def timed(self, name, func):
+        def timed_func(*args, **kwargs):
+            self.enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.exit()
+        return timed_func
+
+    '''
+    Time the named methods of obj as stage name
+    '''
+    def instrument(self, obj, method_names, name):
+        for method_name in method_names:
+            setattr(obj, method_name, self.timed(name, getattr(obj, method_name)))
+
+    '''
+    Yield the items of iterable, timing each step as stage name
+    '''
+    def timed_iter(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            self.enter(name)
+            try:
+                item = next(iterator, StopIteration)
+            finally:
+                self.exit()
+            if item is StopIteration:
+                return
+            yield item
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    '''
+    Record an lru_cache's hits and misses, adding those of the worker
+    processes' copies of it, (hits, misses, size) counts returned with
+    their shards. The size is the largest any process's copy grew to.
+    '''
+    def cache(self, name, cached_func, shard_counts=()):
+        info = cached_func.cache_info()
+        hits = info.hits + sum(shard_hits for shard_hits, shard_misses, shard_size in shard_counts)
+        misses = info.misses + sum(shard_misses for shard_hits, shard_misses, shard_size in shard_counts)
+        self.caches[name] = {
+            "hits":hits,
+            "misses":misses,
+            "hit_rate":round(hits/(hits+misses), 4) if hits+misses else None,
+            "size":max([info.currsize]+[shard_size for shard_hits, shard_misses, shard_size in shard_counts]),
+        }
+
+    def write(self, path):
+        self.switch()
+        wall = time.perf_counter() - self.start_wall
+        lines = self.counters.get("lines", 0)
+        metrics = {
+            "wall_seconds":round(wall, 3),
+            "cpu_seconds":round(time.process_time() - self.start_cpu, 3),
+            # kilobytes on Linux
+            "peak_rss_mb":round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024, 1),
+            "lines":lines,
+            "lines_per_second":round(lines/wall) if wall else None,
+            "stages":{name:{"wall_seconds":round(stage_wall, 4), "cpu_seconds":round(stage_cpu, 4), "calls":calls}
+                      for name, (stage_wall, stage_cpu, calls) in self.stages.items()},
+            "counters":self.counters,
+            "gauges":self.gauges,
+            "caches":self.caches,
+        }
+        with open(path, "w", encoding="UTF-8") as outfile:
+            json.dump(metrics, outfile, indent=1)
+        if self.profiler is not None:
+            self.profiler.dump_stats(path+".prof")
+
+'''
+Metrics turned off: nothing is wrapped or recorded
+'''
+class NullMetrics:
+    def stage(self, name):
+        return nullcontext()
+
+    def timed(self, name, func):
+        return func
+
+    def instrument(self, obj, method_names, name):
+        pass
+
+    def timed_iter(self, name, iterable):
+        return iterable
+
+    def count(self, name, n=1):
+        pass
+
+    def gauge(self, name, value):
+        pass
+
+    def cache(self, name, cached_func, shard_counts=()):
+        pass
+
+NULL_METRICS = NullMetrics()
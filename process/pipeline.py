@@ -0,0 +1,302 @@
+"""
+Single-read processing pipeline
+
+The dumps are several GB of jsonl and json.loads is most of the cost of
+reading them, so every stage that needs the tweets is fed from one pass:
+run_pipeline reads each line once, parses it once and hands the tweet to
+every sink in turn. process.py (display files) and process_user_text.py
+(user text corpus) are just sink configurations; either can run both
+sinks in the same pass.
+
+A sink implements:
+    resume_point(filename, path)    (offset, lines) already consumed from
+                                    the file, (0, 0) to read all of it, or
+                                    None to skip a file read to its end
+                                    before and unchanged since
+    process(tweet)                  fold one parsed tweet in
+    checkpoint(filename, path, offset, lines, at_end=False)
+                                    called every checkpoint_lines lines and
+                                    at the end of each file (with at_end),
+                                    with the bytes and lines consumed so far
+    finish()                        write the outputs, once per run
+    decode_paths()                  the key paths the sink reads from a
+                                    tweet, under which retweeted_status and
+                                    quoted_status are read the same way
+                                    (see decode.py)
+
+and, for parallel runs, shard_spec() returning (shard class, args). Each
+worker builds shard_class(*args), calls process(tweet) for every line of
+its byte range and returns result(); the sink's merge(result) folds the
+shard results back in input order. tests/test_parallel.py checks the
+display output of parallel runs is byte for byte the serial one.
+
+Data files ending in .gz, .bz2 or .xz are read compressed. Decompression
+runs in a reader thread a few blocks ahead of the parsing loop (zlib, bz2
+and lzma release the GIL while they work), so the two overlap. Compressed
+files can't be split into byte ranges, so parallel runs hand workers
+batches of lines from the reader instead. Offsets of compressed files
+count decompressed bytes.
+
+Lines are decoded by the decoder named in run_pipeline (see decode.py),
+which only has to materialize the paths the sinks read.
+
+run_pipeline times its stages (reading, parsing, waiting on workers,
+merging, checkpoints and finishing) in metrics, if given (see metrics.py).
+"""
+
+import os
+import bz2
+import gzip
+import lzma
+import queue
+import threading
+from collections import deque
+from multiprocessing import Pool
+
+from store import iter_batches
+from metrics import NULL_METRICS
+from decode import make_decoder
+
+COMPRESSED_OPENERS = {".gz":gzip.open, ".bz2":bz2.open, ".xz":lzma.open}
+# decompressed bytes per block handed from the reader thread, and the
+# number of blocks it may read ahead
+READ_BLOCK = 1 << 20
+READ_AHEAD = 8
+# lines per batch sent to a worker for compressed input
+BATCH_LINES = 10000
+
+# decoders built in this process, by (name, paths)
+decoders = {}
+
+'''
+Return the decoder for a (name, paths) spec, building it once per process
+'''
+def get_decoder(decoder_spec):
+    if decoder_spec not in decoders:
+        name, paths = decoder_spec
+        decoders[decoder_spec] = make_decoder(name, paths)
+    return decoders[decoder_spec]
+
+def is_compressed(path):
+    return os.path.splitext(path)[1] in COMPRESSED_OPENERS
+
+'''
+Open a data file for binary reading, decompressing by extension
+'''
+def open_input(path):
+    extension = os.path.splitext(path)[1]
+    if extension in COMPRESSED_OPENERS:
+        return COMPRESSED_OPENERS[extension](path, "rb")
+    return open(path, "rb")
+
+'''
+Reader thread: put blocks of infile on the queue, then b"" at the end or
+the exception that stopped it
+'''
+def read_blocks(infile, blocks):
+    try:
+        while True:
+            block = infile.read(READ_BLOCK)
+            blocks.put(block)
+            if not block:
+                return
+    except Exception as e:
+        blocks.put(e)
+
+'''
+Yield the lines of a data file from a (decompressed) byte offset, each
+with its trailing newline
+'''
+def iter_lines(path, offset=0):
+    with open_input(path) as infile:
+        infile.seek(offset)
+        if not is_compressed(path):
+            yield from infile
+            return
+        blocks = queue.Queue(READ_AHEAD)
+        threading.Thread(target=read_blocks, args=(infile, blocks), daemon=True).start()
+        rest = b""
+        while True:
+            block = blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                break
+            lines = (rest+block).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                yield line+b"\n"
+        if rest:
+            yield rest
+
+'''
+Split a jsonl file into (path, start, end) byte ranges that start and end
+on line boundaries
+'''
+def shard_ranges(path, shard_count, start=0):
+    size = os.path.getsize(path)
+    bounds = [start]
+    with open(path,"rb") as infile:
+        for i in range(1, shard_count):
+            # at least 1: a file smaller than shard_count bytes puts the
+            # first bounds at 0, with no byte before them to seek to
+            offset = max(start+(size-start)*i//shard_count, bounds[-1], 1)
+            if offset >= size:
+                break
+            # move to the first line starting at or after offset
+            infile.seek(offset-1)
+            infile.readline()
+            bounds.append(min(infile.tell(), size))
+    bounds.append(size)
+    return [(path,shard_start,shard_end) for shard_start,shard_end in zip(bounds,bounds[1:]) if shard_end > shard_start]
+
+'''
+Worker side of sharded ingestion: feed one byte range to fresh shard
+sinks, returning their results and the number of lines read
+'''
+def process_shard(shard):
+    path, start, end, shard_specs, decoder_spec = shard
+    shard_sinks = [shard_class(*args) for shard_class, args in shard_specs]
+    loads = get_decoder(decoder_spec)
+    line_count = 0
+    with open(path,"rb") as infile:
+        infile.seek(start)
+        position = start
+        for line in infile:
+            if position >= end:
+                break
+            position += len(line)
+            tweet = loads(line)
+            for shard_sink in shard_sinks:
+                shard_sink.process(tweet)
+            line_count += 1
+    return [shard_sink.result() for shard_sink in shard_sinks], line_count
+
+'''
+Worker side for compressed input: feed a batch of lines to fresh shard sinks
+'''
+def process_lines(batch):
+    lines, shard_specs, decoder_spec = batch
+    shard_sinks = [shard_class(*args) for shard_class, args in shard_specs]
+    loads = get_decoder(decoder_spec)
+    for line in lines:
+        tweet = loads(line)
+        for shard_sink in shard_sinks:
+            shard_sink.process(tweet)
+    return [shard_sink.result() for shard_sink in shard_sinks], len(lines)
+
+'''
+Yield (byte length, lines) batches of BATCH_LINES lines of a data file
+'''
+def iter_line_batches(path, offset):
+    for lines in iter_batches(iter_lines(path, offset), BATCH_LINES):
+        yield sum(len(line) for line in lines), lines
+
+'''
+Return the (offset, lines) every sink resumes a file at
+'''
+def resume_point(sinks, filename, path):
+    points = set(sink.resume_point(filename, path) for sink in sinks)
+    # None (already read) next to an offset is a difference too
+    if len(points) > 1:
+        raise ValueError("sinks resume "+filename+" at different offsets, run them separately")
+    return points.pop()
+
+'''
+Read every data file once, feeding each parsed tweet to all sinks, then
+finish the sinks. workers > 0 splits each file into that many shards
+processed in parallel and merged in input order. decoder names the JSON
+decoder, "auto" for orjson or json (see decode.py).
+'''
+def run_pipeline(data_files, sinks, data_dir="./data/", workers=0, checkpoint_lines=2000, metrics=NULL_METRICS,
+                 decoder="auto"):
+    counter = 0
+    decoder_spec = (decoder, tuple(tuple(path) for sink in sinks for path in sink.decode_paths()))
+    loads = metrics.timed("parse", get_decoder(decoder_spec))
+    for filename in data_files:
+        path = data_dir+filename
+        point = resume_point(sinks, filename, path)
+        if point is None:
+            print("Skipping", filename, "(already processed)")
+            continue
+        # byte offset and line count consumed from this file so far
+        offset, line_count = point
+        if workers and is_compressed(path):
+            # hand line batches to the workers as the reader decompresses,
+            # keeping only a few per worker in flight (Pool.imap would read
+            # the whole file ahead), and merge them back in input order
+            shard_specs = [sink.shard_spec() for sink in sinks]
+            pending = deque()
+            with Pool(workers) as pool:
+                batches = metrics.timed_iter("read", iter_line_batches(path, offset))
+                while True:
+                    for size, lines in batches:
+                        pending.append((size, pool.apply_async(process_lines, ((lines, shard_specs, decoder_spec),))))
+                        if len(pending) >= 2*workers:
+                            break
+                    if not pending:
+                        break
+                    size, pending_result = pending.popleft()
+                    with metrics.stage("workers"):
+                        results, batch_line_count = pending_result.get()
+                    with metrics.stage("merge"):
+                        for sink, result in zip(sinks, results):
+                            sink.merge(result)
+                    offset += size
+                    line_count += batch_line_count
+                    with metrics.stage("checkpoint"):
+                        for sink in sinks:
+                            sink.checkpoint(filename, path, offset, line_count)
+                    counter += batch_line_count
+                    metrics.count("lines", batch_line_count)
+                    print("Processing tweet #"+str(counter))
+            with metrics.stage("checkpoint"):
+                for sink in sinks:
+                    sink.checkpoint(filename, path, offset, line_count, at_end=True)
+            continue
+        if workers:
+            # split the file on line boundaries, extract each shard in a
+            # worker process and merge the shards back in input order
+            shard_specs = [sink.shard_spec() for sink in sinks]
+            shards = [(path, start, end, shard_specs, decoder_spec) for path, start, end in shard_ranges(path, workers, offset)]
+            with Pool(workers) as pool:
+                shard_results = metrics.timed_iter("workers", pool.imap(process_shard, shards))
+                for shard, (results, shard_line_count) in zip(shards, shard_results):
+                    with metrics.stage("merge"):
+                        for sink, result in zip(sinks, results):
+                            sink.merge(result)
+                    offset = shard[2]
+                    line_count += shard_line_count
+                    with metrics.stage("checkpoint"):
+                        for sink in sinks:
+                            sink.checkpoint(filename, path, offset, line_count)
+                    counter += shard_line_count
+                    metrics.count("lines", shard_line_count)
+                    print("Processing tweet #"+str(counter))
+            with metrics.stage("checkpoint"):
+                for sink in sinks:
+                    sink.checkpoint(filename, path, offset, line_count, at_end=True)
+            continue
+        file_start = line_count
+        for line in metrics.timed_iter("read", iter_lines(path, offset)):
+            tweet = loads(line)
+            for sink in sinks:
+                sink.process(tweet)
+            offset += len(line)
+            line_count += 1
+
+            counter+=1
+            if counter % checkpoint_lines == 0:
+                with metrics.stage("checkpoint"):
+                    for sink in sinks:
+                        sink.checkpoint(filename, path, offset, line_count)
+                print("Processing tweet #"+str(counter))
+        with metrics.stage("checkpoint"):
+            for sink in sinks:
+                sink.checkpoint(filename, path, offset, line_count, at_end=True)
+        metrics.count("lines", line_count - file_start)
+
+    # outputs are written once, after every input file is read
+    with metrics.stage("finish"):
+        for sink in sinks:
+            sink.finish()
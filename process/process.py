@@ -6,21 +6,31 @@ API dump jsonl files (typically saved as .json files)
 into our archival display files, stripping out
 deprecated, extraneous, and redundant data.
 
-Input filenames go into the DATA_FILES list. Output
-appears in the output directory.
+Input filenames go into the DATA_FILES list, or on
+the command line (files in ./data/) to override it;
+.gz, .bz2 and .xz dumps are read without
+decompressing them first. Output appears in the
+output directory.
 
 Output separates tweet and user data to save space.
 
+This file only holds the settings: the input is read
+once by pipeline.py and the display files are built
+by display.py.
+
 Performance seems good enough for our purposes
-(6 seconds for 100k tweets).
+(6 seconds for 100k tweets). bench/run_bench.py
+measures every stage on generated dumps.
 
 """
 
-import json
-from collections import defaultdict
-from itertools import islice
-from datetime import datetime, timezone, timedelta
-from collections import Counter
+import os
+import sys
+
+from store import open_store
+from display import DisplaySink
+from pipeline import run_pipeline
+from metrics import Metrics, NULL_METRICS
 
 
 DATA_FILES = [
@@ -31,9 +41,69 @@ DATA_FILES = [
 ]
 
 BOX_SIZE = 2000
+# number of worker processes for sharded ingestion (0 processes serially)
+PARALLEL_WORKERS = 0
 # EDT is UTC-4, EST is UTC-5
 TZ_OFFSET = -4
 OUTPUT_FILENAME = "cville814"
+# where display tweets and users are kept until the output is written:
+# "memory", "compact" for slot records and array-backed retweet lists, or
+# "sqlite" to keep them on disk at STORE_PATH so memory use stays flat for
+# the full multi-day datasets (see store.py)
+STORE_BACKEND = "memory"
+STORE_PATH = "./data/display_store_"+OUTPUT_FILENAME+".sqlite"
+# write chunk files in id order with a compact manifest of per-chunk
+# (min_id, max_id) ranges (disp_twranges_/disp_uranges_) instead of the
+# per-id disp_twids_/disp_userids_ maps, see chunk_index.py
+ID_RANGE_INDEX = False
+# sort list output: "json" id arrays, "binary" packed uint32 chunk
+# positions (sort_<order>_*.bin, see sort_lists.py) or "both"
+SORT_FORMAT = "json"
+# also split each sort order into pages of this many ids with a
+# sort_pages_<name>.json header (0 disables), and write the first
+# SORT_TOP_N tweets of each order with their records to top_<order>_*.json
+SORT_PAGE_SIZE = 0
+SORT_TOP_N = 0
+# chunk files for static hosting: COMPACT_JSON drops the spaces after
+# separators, PRECOMPRESS also writes .gz (and .br if the brotli module is
+# installed) next to each chunk, and CHUNK_TARGET_BYTES (0 disables) cuts
+# chunks at about that many gzipped bytes instead of every BOX_SIZE records,
+# BOX_SIZE then being the most a chunk holds (see display.py)
+COMPACT_JSON = False
+PRECOMPRESS = False
+CHUNK_TARGET_BYTES = 0
+# split the tweet chunk files, id lookups and sort lists by local date
+# ("date") or local hour ("hour") at TZ_OFFSET, each partition named
+# <OUTPUT_FILENAME>_<partition> and listed in partitions_<name>.json, so a
+# time window only needs its own files. None writes one set for all tweets.
+PARTITION_BY = None
+# also write every display tweet and user to records_<name>.bin with an
+# id/sort order index, records_<name>.idx, for lookups by id without the
+# chunk files (see record_file.py)
+RECORD_FILE = False
+# keep the sqlite store between runs and only read input not seen before,
+# rewriting just the chunk files that changed (see incremental.py). Needs
+# STORE_BACKEND = "sqlite" and insertion-order chunks (no ID_RANGE_INDEX);
+# delete STORE_PATH to rebuild from scratch.
+INCREMENTAL = False
+MANIFEST_PATH = "./output/manifest_"+OUTPUT_FILENAME+".json"
+# also write the user text corpus (see process_user_text.py) from the same
+# read of the input
+WRITE_USER_TEXT = False
+# also write data/pseudonyms_<name>.json, a pseudonym for every user id (see
+# obfuscation/pseudonyms.py), from the same read of the input. It maps
+# real ids to pseudonyms, so it's kept out of the published output/
+WRITE_PSEUDONYMS = False
+# write per-stage wall/CPU times, lines/s, peak RSS, store sizes and cache
+# hit rates to this JSON file at the end of the run (see metrics.py); None
+# turns the instrumentation off. PROFILE_STAGE runs one stage ("extract",
+# "dedupe", "write_chunks", ...) under cProfile, into METRICS_PATH+".prof".
+METRICS_PATH = None
+PROFILE_STAGE = None
+# JSON decoder for input lines (see decode.py): "orjson", "simdjson" (only
+# builds the fields the outputs use, but is slower than json on tweets
+# this size) or "json". "auto" picks orjson if installed, otherwise json.
+JSON_DECODER = "auto"
 
 """
 Twitter API object documentation:
@@ -88,96 +158,6 @@ USER_SCHEMA = {
         "created_at":["created_at"]
 }
 
-'''
-Follow the schema to extract a single display attribute
-'''
-def parse_attribute(source,twitter_element):
-    for i in source:
-        if i in twitter_element:
-            twitter_element = twitter_element[i]
-        else:
-            return None
-    return twitter_element
-
-'''
-follow the schema to extract the attributes for a single display tweet
-'''
-def extract_display_tweet(tweet):
-    display_tweet = {}
-    for target, source in TWEET_SCHEMA.items():
-        att = parse_attribute(source,tweet)
-        if att:
-            display_tweet[target] = att
-    return display_tweet
-
-'''
-Recursively return a twid:display_tweet dictionary of all upstream RT/QRT
-'''
-def extract_display_tweets(tweet):
-    display_tweets = {}
-    display_tweet = extract_display_tweet(tweet)
-    # special hashtag processing
-    display_hashtags = set()
-    for hashtag in tweet["entities"]["hashtags"]:
-        display_hashtags.add(hashtag["text"].lower())
-    display_tweet["hashtags"] = list(display_hashtags)
-    display_tweets[display_tweet["id"]] = display_tweet
-
-    if "retweeted_status" in tweet:
-        display_tweets.update(extract_display_tweets(tweet["retweeted_status"]))
-    if "quoted_status" in tweet:
-        display_tweets.update(extract_display_tweets(tweet["quoted_status"]))
-    return display_tweets
-
-
-'''
-follow the schema to extract the attributes for a single display tweet
-'''
-def extract_display_user(tweet):
-    display_user = {}
-    for target, source in USER_SCHEMA.items():
-        display_user[target] = parse_attribute(source,tweet["user"])
-    # construct search fields (0 is smallest)
-    if not display_user["followers_count"]:
-        display_user["followers_count"] = 0
-    display_user["size"] = len(USER_SIZE_BOUNDS)
-    for size in reversed(range(len(USER_SIZE_BOUNDS))):
-        if int(display_user["followers_count"]) < USER_SIZE_BOUNDS[size]:
-            display_user["size"] = size
-    
-    # created_at fields
-    date_format = "%a %b %d %H:%M:%S %z %Y"
-    created_at = datetime.strptime(display_user["created_at"], date_format)
-    display_user["created_at"] = int(created_at.timestamp())
-
-    local_date_str = created_at.astimezone(timezone(timedelta(hours=TZ_OFFSET))).strftime('%Y-%m-%d')
-    display_user["created_year"] = created_at.strftime('%Y')
-    return display_user
-
-
-'''
-Recursively return a twid:display_user dictionary of all upstream RT/QRT
-'''
-def extract_display_users(tweet):
-    display_users = {}
-    display_user = extract_display_user(tweet)
-    display_users[display_user["id"]] = display_user
-    if "retweeted_status" in tweet:
-        display_users.update(extract_display_users(tweet["retweeted_status"]))
-    if "quoted_status" in tweet:
-        display_users.update(extract_display_users(tweet["quoted_status"]))
-    return display_users
-
-def chunk_dictionary(input_dict, chunk_size):
-    dict_iterator = iter(input_dict.items())
-    for i in range(0, len(input_dict), chunk_size):
-        yield dict(islice(dict_iterator, chunk_size))
-
-# test = json.load(open("./data/test.json","r",encoding="utf-8"))
-# print(json.dumps(extract_display_tweets(test),indent=3))
-# print(json.dumps(extract_display_users(test),indent=3))
-# exit()
-
 """
 Potentially useful data?
 "source"
@@ -194,113 +174,24 @@ Notes:
     Twitter front end. We might want to use some of those
     values, depending on how we decide to handle RTs.
 """
-display_tweets = {}
-display_users = {}
-retweets = defaultdict(str)
-quote_retweets = defaultdict(list)
-counter = 0
-
-retweets_count = Counter()
-
-for filename in DATA_FILES:
-    with open("./data/"+filename,"r",-1,"UTF-8") as infile:
-        for line in infile:
-            tweet = json.loads(line)
-            # extract all display tweets from tweet 
-            extracted_tweets = extract_display_tweets(tweet)
-            # filter out tweets already extracted
-            extracted_tweets = {k:v for k,v in extracted_tweets.items() if k not in display_tweets}
-            
-            # convert datetime string to unix epoch
-            for twid,extracted_tweet in extracted_tweets.items():
-                dtstr = extracted_tweet["created_at"]
-                # print(twid)
-                # print(json.dumps(extracted_tweet,indent=2))
-                date_format = "%a %b %d %H:%M:%S %z %Y"
-                dt = datetime.strptime(dtstr, date_format)
-                local_date_str = dt.astimezone(timezone(timedelta(hours=TZ_OFFSET))).strftime('%Y-%m-%d')
-                # local_time_str = dt.astimezone(timezone(timedelta(hours=TZ_OFFSET))).strftime('%H:%M:%S')
-                timestamp = dt.timestamp()
-                extracted_tweet["created_at"] = int(timestamp)
-                extracted_tweet["local_date"] = local_date_str
-                # extracted_tweet["local_time"] = local_time_str
-            
-            # update main display tweets dictionary with extracted tweets
-            display_tweets.update(extracted_tweets)
-
-            # remove retweets and append info to parent
-            for extracted_tweet in extracted_tweets.values():
-                if "retweeted_status_id" in extracted_tweet:
-                    parent = display_tweets[extracted_tweet["retweeted_status_id"]]
-                    if "retweets" not in parent:
-                        parent["retweets"] = []
-                    parent["retweets"].append((extracted_tweet["user_id"],extracted_tweet["user_screen_name"],extracted_tweet["created_at"]))
-                    # parent["retweets"].append((extracted_tweet["user_id"],extracted_tweet["user_screen_name"]))
-                    del display_tweets[extracted_tweet["id"]]
-                elif "quoted_status_id" in extracted_tweet:
-                    quote_retweets[str(extracted_tweet["quoted_status_id"])].append(extracted_tweet["id"])
-            
-            # extract all users
-            extracted_users = extract_display_users(tweet)
-            display_users.update(extracted_users)
-
-            counter+=1
-            if counter % BOX_SIZE == 0:
-                print("Processing tweet #"+str(counter))
-            # if counter > BOX_SIZE*1:
-            #     break
-    
-    # for id,tweet in display_tweets.items():
-    #     if "retweets" in tweet:
-    #         retweets_count[tweet["id"]] = len(tweet["retweets"])
-
-    # for twid,retweet_count in retweets_count.most_common(20):
-    #     print(twid, retweet_count, "retweets")
-
-    # append quote retweet info to parent tweets
-    for parent_id, qrt_ids in quote_retweets.items():
-        if parent_id in display_tweets:
-            parent = display_tweets[parent_id]
-            parent["quote_retweets"] = qrt_ids
-            parent["quote_retweet_count"] = len(qrt_ids)
-
-    file_count = 0
-    display_twids = {}
-    for chunk in chunk_dictionary(display_tweets, BOX_SIZE):
-        print("Writing tweet file",str(file_count)+"/"+str(int(len(display_tweets)/BOX_SIZE)))
-        print("  (",len(chunk),"tweets )")
-        tweets_fn = "disp_tw_"+OUTPUT_FILENAME+"-"+str(file_count).zfill(3)+".json"
-        with open("./output/"+tweets_fn, "w", encoding="UTF-8") as outfile:
-            json.dump(chunk,outfile)
-        for twid,tweet in chunk.items():
-            display_twids[twid] = tweets_fn
-        file_count+=1
-
-    with open("./output/disp_twids_"+OUTPUT_FILENAME+".json", "w", encoding="UTF-8") as outfile:
-        json.dump(display_twids,outfile)
 
-    
-    # create sort lists
-    with open("./output/sort_chrono_"+OUTPUT_FILENAME+".json", "w", encoding="UTF-8") as outfile:
-        json.dump([display_tweet["id"] for display_tweet in sorted(display_tweets.values(), key=lambda t: int(t.get("id",0)), reverse=False)],outfile)
-    with open("./output/sort_favs_"+OUTPUT_FILENAME+".json", "w", encoding="UTF-8") as outfile:    
-        json.dump([display_tweet["id"] for display_tweet in sorted(display_tweets.values(), key=lambda t: int(t.get("favorite_count",0)), reverse=True)],outfile)
-    with open("./output/sort_retweets_"+OUTPUT_FILENAME+".json", "w", encoding="UTF-8") as outfile:
-        json.dump([display_tweet["id"] for display_tweet in sorted(display_tweets.values(), key=lambda t: int(t.get("retweet_count",0)), reverse=True)],outfile)
-    with open("./output/sort_followers_"+OUTPUT_FILENAME+".json", "w", encoding="UTF-8") as outfile:
-        json.dump([display_tweet["id"] for display_tweet in sorted(display_tweets.values(), key=lambda t: (int(display_users[t["user_id"]]["followers_count"]), -int(t.get("created_at",0))), reverse=True)],outfile)
-    
-    file_count = 0
-    display_userids = {}
-    for chunk in chunk_dictionary(display_users, BOX_SIZE):
-        print("Writing user file",str(file_count)+"/"+str(int(len(display_tweets)/BOX_SIZE)))
-        print("  (",len(chunk),"users )")
-        users_fn = "disp_u_"+OUTPUT_FILENAME+"-"+str(file_count).zfill(3)+".json"
-        with open("./output/"+users_fn, "w", encoding="UTF-8") as outfile:
-            json.dump(chunk,outfile)
-        for userid,user in chunk.items():
-            display_userids[userid] = users_fn
-        file_count+=1
-            
-    with open("./output/disp_userids_"+OUTPUT_FILENAME+".json", "w", encoding="UTF-8") as outfile:
-        json.dump(display_userids,outfile)
\ No newline at end of file
+if __name__ == "__main__":
+    metrics = Metrics(PROFILE_STAGE) if METRICS_PATH else NULL_METRICS
+    store = open_store(STORE_BACKEND, STORE_PATH, list(TWEET_SCHEMA)+["hashtags","local_date"], incremental=INCREMENTAL)
+    sinks = [DisplaySink(store, TWEET_SCHEMA, USER_SCHEMA, USER_SIZE_BOUNDS, TZ_OFFSET, OUTPUT_FILENAME,
+                         box_size=BOX_SIZE, id_range_index=ID_RANGE_INDEX, sort_format=SORT_FORMAT,
+                         sort_page_size=SORT_PAGE_SIZE, sort_top_n=SORT_TOP_N, compact_json=COMPACT_JSON,
+                         precompress=PRECOMPRESS, chunk_target_bytes=CHUNK_TARGET_BYTES, partition_by=PARTITION_BY,
+                         record_file=RECORD_FILE,
+                         incremental=INCREMENTAL, manifest_path=MANIFEST_PATH, metrics=metrics)]
+    if WRITE_USER_TEXT:
+        from process_user_text import user_text_sink
+        sinks.append(user_text_sink())
+    if WRITE_PSEUDONYMS:
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "obfuscation"))
+        from pseudonyms import PseudonymSink
+        sinks.append(PseudonymSink(OUTPUT_FILENAME))
+    run_pipeline(sys.argv[1:] or DATA_FILES, sinks, workers=PARALLEL_WORKERS, checkpoint_lines=BOX_SIZE, metrics=metrics,
+                 decoder=JSON_DECODER)
+    if METRICS_PATH:
+        metrics.write(METRICS_PATH)
\ No newline at end of file
@@ -6,8 +6,11 @@ API dump jsonl files (typically saved as .json files)
 into our archival display files, stripping out
 deprecated, extraneous, and redundant data.
 
-Input filenames go into the DATA_FILES list. Output
-appears in the output directory.
+Input filenames go into the DATA_FILES list, or on
+the command line (files in ./data/) to override it;
+.gz, .bz2 and .xz dumps are read without
+decompressing them first. Output appears in the
+output directory.
 
 Output separates tweet and user data to save space.
 
@@ -16,11 +19,10 @@ Performance seems good enough for our purposes
 
 """
 
-import json
-from collections import defaultdict
-from itertools import islice
-from datetime import datetime
-from collections import Counter
+import sys
+
+from user_text import UserTextSink, StreamingUserTextSink
+from pipeline import run_pipeline
 
 
 DATA_FILES = [
@@ -32,6 +34,13 @@ DATA_FILES = [
     # "cvlf10k.json"
 ]
 
+# write the corpus while the input is read, once per distinct text, instead
+# of keeping every text until the end (see user_text.py)
+STREAM_OUTPUT = False
+# with STREAM_OUTPUT, split each corpus into files of this many texts
+# (tw_usertext-000.json, ...); 0 writes a single file
+CORPUS_SHARD_LINES = 0
+
 """
 Twitter API object documentation:
 https://developer.x.com/en/docs/x-api/v1/data-dictionary/object-model/tweet
@@ -63,73 +72,6 @@ USER_SCHEMA = {
         "id":["id_str"],
 }
 
-'''
-Follow the schema to extract a single display attribute
-'''
-def parse_attribute(source,twitter_element):
-    for i in source:
-        if i in twitter_element:
-            twitter_element = twitter_element[i]
-        else:
-            return None
-    return twitter_element
-
-'''
-follow the schema to extract the attributes for a single display tweet
-'''
-def extract_display_tweet(tweet):
-    display_tweet = {}
-    for target, source in TWEET_SCHEMA.items():
-        att = parse_attribute(source,tweet)
-        if att:
-            display_tweet[target] = att
-    return display_tweet
-
-'''
-Recursively return a twid:display_tweet dictionary of all upstream RT/QRT
-'''
-def extract_display_tweets(tweet):
-    display_tweets = {}
-    display_tweet = extract_display_tweet(tweet)
-    # special hashtag processing
-    display_hashtags = set()
-    for hashtag in tweet["entities"]["hashtags"]:
-        display_hashtags.add(hashtag["text"].lower())
-    display_tweet["hashtags"] = list(display_hashtags)
-    display_tweets[display_tweet["id"]] = display_tweet
-
-    if "retweeted_status" in tweet:
-        display_tweets.update(extract_display_tweets(tweet["retweeted_status"]))
-    if "quoted_status" in tweet:
-        display_tweets.update(extract_display_tweets(tweet["quoted_status"]))
-    return display_tweets
-
-
-'''
-follow the schema to extract the attributes for a single display tweet
-'''
-def extract_display_user(tweet):
-    display_user = {}
-    for target, source in USER_SCHEMA.items():
-        att = parse_attribute(source,tweet["user"])
-        if att:
-            display_user[target] = att
-    return display_user
-
-
-'''
-Recursively return a twid:display_user dictionary of all upstream RT/QRT
-'''
-def extract_display_users(tweet):
-    display_users = {}
-    display_user = extract_display_user(tweet)
-    display_users[display_user["id"]] = display_user
-    if "retweeted_status" in tweet:
-        display_users.update(extract_display_users(tweet["retweeted_status"]))
-    if "quoted_status" in tweet:
-        display_users.update(extract_display_users(tweet["quoted_status"]))
-    return display_users
-
 """
 Potentially useful data?
 "source"
@@ -146,48 +88,14 @@ Notes:
     Twitter front end. We might want to use some of those
     values, depending on how we decide to handle RTs.
 """
-display_tweets = {}
-display_users = {}
-retweets = defaultdict(str)
-counter = 0
-
-retweets_count = Counter()
-
-for filename in DATA_FILES:
-    with open("./data/"+filename,"r",-1,"UTF-8") as infile:
-        for line in infile:
-            tweet = json.loads(line)
-            # extract all display tweets from tweet 
-            extracted_tweets = extract_display_tweets(tweet)
-            # filter out tweets already extracted
-            extracted_tweets = {k:v for k,v in extracted_tweets.items() if k not in display_tweets}
-            # update main display tweets dçictionary with extracted tweets
-            display_tweets.update(extracted_tweets)
-
-            # remove retweets and append info to parent
-            for extracted_tweet in extracted_tweets.values():
-                if "retweeted_status_id" in extracted_tweet:
-                   del display_tweets[extracted_tweet["id"]]
-            
-            # extract all users
-            extracted_users = extract_display_users(tweet)
-            users = {k:v for k,v in extracted_users.items() if k not in display_users}
-            display_users.update(extracted_users)
-
-    tw_user_texts = []
-    for tw in display_tweets.values():
-        tw_user_texts.append(tw["text"].replace("\n"," ")+"\n")
-    u_user_texts = []
-    for u in display_users.values():
-        for k in USER_SCHEMA.keys():
-            if k in u and k != "id":
-                u_user_texts.append(u[k].replace("\n"," "))
-        u_user_texts.append("\n")
-    
-    with open("./output/tw_usertext.json", "w", encoding="UTF-8") as outfile:
-        for text in tw_user_texts:
-            outfile.write(text+" ")
-    
-    with open("./output/u_usertext.json", "w", encoding="UTF-8") as outfile:
-        for text in u_user_texts:
-            outfile.write(text+" ")
\ No newline at end of file
+
+'''
+The user text sink for these settings
+'''
+def user_text_sink():
+    if STREAM_OUTPUT:
+        return StreamingUserTextSink(TWEET_SCHEMA, USER_SCHEMA, shard_lines=CORPUS_SHARD_LINES)
+    return UserTextSink(TWEET_SCHEMA, USER_SCHEMA)
+
+if __name__ == "__main__":
+    run_pipeline(sys.argv[1:] or DATA_FILES, [user_text_sink()])
@@ -0,0 +1,170 @@
+"""
+Memory-mapped record file
+
+The chunk files suit the viewer, but finding a few tweets in them means
+loading and parsing 2000-record JSON files. For local analysis and server
+side use, process.py can also write every display tweet and user into one
+binary file, records_<name>.bin, with an index, records_<name>.idx:
+
+    header          magic, tweet count, user count, order count and the
+                    SORT_ORDERS names, 16 bytes each
+    tweet table     (id, offset, length) of every tweet, sorted by id
+    user table      (id, offset, length) of every user, sorted by id
+    order tables    for every order, the tweet table position of each
+                    tweet in that order, as uint32
+
+all little-endian, with ids as uint64. Each record is the display tweet
+or user as compact JSON, without spaces after separators and with
+non-ASCII characters as UTF-8 rather than escaped, so its bytes differ
+from the chunk files' (unless COMPACT_JSON, and then only for ASCII text)
+but it parses to the same record.
+RecordFile mmaps both files: a lookup by id is a binary search over the
+fixed-width table and a slice of one order is a slice of its table, and
+only the records asked for are ever parsed.
+
+Look up records from the command line:
+    python process/record_file.py output/records_cville814 tweet 896000000000000001
+    python process/record_file.py output/records_cville814 user 12345
+    python process/record_file.py output/records_cville814 favs 0 10
+"""
+
+import json
+import mmap
+import struct
+
+from sort_lists import SORT_ORDERS, chunk_positions, pack_positions
+
+MAGIC = b"TWRECIDX"
+HEADER = struct.Struct("<8sQQQ")
+ORDER_NAME = struct.Struct("<16s")
+ENTRY = struct.Struct("<QQI")
+POSITION = struct.Struct("<I")
+
+'''
+Append the compact JSON of (id, record) items to outfile, returning their
+(id, offset, length) entries
+'''
+def write_records(items, outfile):
+    entries = []
+    for id, record in items:
+        data = json.dumps(record, separators=(",",":"), ensure_ascii=False).encode("UTF-8")
+        entries.append((int(id), outfile.tell(), len(data)))
+        outfile.write(data)
+    return entries
+
+'''
+Write the record and index files from the store's tweet and user chunks
+in insertion order, with permutations of insertion-order indexes (see
+sort_lists.py) for the order tables
+'''
+def write_record_file(tweet_chunks, user_chunks, permutations, path_prefix):
+    with open(path_prefix+".bin", "wb") as outfile:
+        tweet_entries = write_records((item for chunk in tweet_chunks for item in chunk.items()), outfile)
+        user_entries = write_records((item for chunk in user_chunks for item in chunk.items()), outfile)
+
+    with open(path_prefix+".idx", "wb") as outfile:
+        outfile.write(HEADER.pack(MAGIC, len(tweet_entries), len(user_entries), len(SORT_ORDERS)))
+        for order in SORT_ORDERS:
+            outfile.write(ORDER_NAME.pack(order.encode("ascii")))
+        # the chrono permutation is the tweets in id order, so the order
+        # tables are the chrono ranks of each order's tweets
+        for index in permutations["chrono"]:
+            outfile.write(ENTRY.pack(*tweet_entries[index]))
+        for entry in sorted(user_entries):
+            outfile.write(ENTRY.pack(*entry))
+        for order in SORT_ORDERS:
+            outfile.write(pack_positions(chunk_positions(permutations, order, True)))
+
+'''
+mmap an existing file read-only; empty files can't be mapped
+'''
+def map_file(path):
+    with open(path, "rb") as infile:
+        try:
+            return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return b""
+
+'''
+Reader over records_<name>.bin / .idx
+'''
+class RecordFile:
+    def __init__(self, path_prefix):
+        self.data = map_file(path_prefix+".bin")
+        self.index = map_file(path_prefix+".idx")
+        magic, self.tweet_count, self.user_count, order_count = HEADER.unpack_from(self.index, 0)
+        if magic != MAGIC:
+            raise ValueError(path_prefix+".idx is not a record index")
+        orders = [ORDER_NAME.unpack_from(self.index, HEADER.size+i*ORDER_NAME.size)[0].rstrip(b"\0").decode("ascii")
+                  for i in range(order_count)]
+        self.tweet_table = HEADER.size + order_count*ORDER_NAME.size
+        self.user_table = self.tweet_table + self.tweet_count*ENTRY.size
+        order_table = self.user_table + self.user_count*ENTRY.size
+        self.order_tables = {order:order_table + i*self.tweet_count*POSITION.size for i, order in enumerate(orders)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for mapped in [self.data, self.index]:
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+    '''
+    Parse the record of the table entry at position
+    '''
+    def read_entry(self, table, position):
+        id, offset, length = ENTRY.unpack_from(self.index, table + position*ENTRY.size)
+        return json.loads(self.data[offset:offset+length])
+
+    '''
+    Binary search a table for id, returning its position or None
+    '''
+    def find(self, table, count, id):
+        id = int(id)
+        low, high = 0, count
+        while low < high:
+            middle = (low+high)//2
+            if struct.unpack_from("<Q", self.index, table + middle*ENTRY.size)[0] < id:
+                low = middle+1
+            else:
+                high = middle
+        if low < count and struct.unpack_from("<Q", self.index, table + low*ENTRY.size)[0] == id:
+            return low
+        return None
+
+    def get_tweet(self, id):
+        position = self.find(self.tweet_table, self.tweet_count, id)
+        return None if position is None else self.read_entry(self.tweet_table, position)
+
+    def get_user(self, id):
+        position = self.find(self.user_table, self.user_count, id)
+        return None if position is None else self.read_entry(self.user_table, position)
+
+    '''
+    Yield the tweets start..stop of an order
+    '''
+    def iter_sorted(self, order, start=0, stop=None):
+        stop = self.tweet_count if stop is None else min(stop, self.tweet_count)
+        order_table = self.order_tables[order]
+        for i in range(start, stop):
+            position = POSITION.unpack_from(self.index, order_table + i*POSITION.size)[0]
+            yield self.read_entry(self.tweet_table, position)
+
+
+if __name__ == "__main__":
+    import sys
+    with RecordFile(sys.argv[1]) as records:
+        if sys.argv[2] == "tweet":
+            for id in sys.argv[3:]:
+                print(json.dumps(records.get_tweet(id)))
+        elif sys.argv[2] == "user":
+            for id in sys.argv[3:]:
+                print(json.dumps(records.get_user(id)))
+        else:
+            start, stop = (int(n) for n in sys.argv[3:5])
+            for tweet in records.iter_sorted(sys.argv[2], start, stop):
+                print(json.dumps(tweet))
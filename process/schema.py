@@ -0,0 +1,116 @@
+"""
+Compiled schema accessors
+
+TWEET_SCHEMA / USER_SCHEMA style dictionaries map a display attribute to
+the key path it is read from in a Twitter API object. parse_attribute
+follows one path at a time, which means an interpreted loop per field per
+record. compile_schema turns a whole schema into a single generated
+function with the paths unrolled into plain dict lookups, so it only has
+to be done once at startup.
+
+The generated code keeps parse_attribute's semantics exactly: a missing
+key anywhere on the path yields None, and with drop_falsy the attribute
+is left out whenever the value is falsy (the `if att:` check).
+
+Run this file directly for a micro-benchmark of the two approaches:
+    python process/schema.py [jsonl file]
+"""
+
+import json
+import timeit
+
+'''
+Follow the schema to extract a single display attribute
+'''
+def parse_attribute(source,twitter_element):
+    for i in source:
+        if i in twitter_element:
+            twitter_element = twitter_element[i]
+        else:
+            return None
+    return twitter_element
+
+'''
+Generate the nested lookups for a single schema path
+'''
+def _path_source(target, source, drop_falsy, depth=1):
+    indent = "    "*depth
+    lines = [indent+"value = element"]
+    for i in source:
+        lines.append(indent+"if "+repr(i)+" in value:")
+        depth += 1
+        indent = "    "*depth
+        lines.append(indent+"value = value["+repr(i)+"]")
+    if drop_falsy:
+        lines.append(indent+"if value:")
+        lines.append(indent+"    record["+repr(target)+"] = value")
+    else:
+        lines.append(indent+"record["+repr(target)+"] = value")
+        # every missing key on the way falls back to None
+        for depth in reversed(range(1, len(source)+1)):
+            indent = "    "*depth
+            lines.append(indent+"else:")
+            lines.append(indent+"    record["+repr(target)+"] = None")
+    return lines
+
+'''
+Compile a schema into a function that extracts a display record from a
+Twitter API object. drop_falsy leaves out attributes with falsy values;
+otherwise every attribute is present, None when its path is missing.
+'''
+def compile_schema(schema, drop_falsy, name="extract_record"):
+    lines = ["def "+name+"(element):", "    record = {}"]
+    for target, source in schema.items():
+        lines.extend(_path_source(target, source, drop_falsy))
+    lines.append("    return record")
+    code = "\n".join(lines)+"\n"
+    namespace = {}
+    exec(compile(code, "<schema "+name+">", "exec"), namespace)
+    extractor = namespace[name]
+    extractor.source = code
+    return extractor
+
+'''
+The pre-compilation extractor, kept as the reference for the benchmark
+'''
+def interpret_schema(schema, drop_falsy, element):
+    record = {}
+    for target, source in schema.items():
+        att = parse_attribute(source,element)
+        if att or not drop_falsy:
+            record[target] = att
+    return record
+
+
+if __name__ == "__main__":
+    import sys
+    from process import TWEET_SCHEMA, USER_SCHEMA
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1],"r",-1,"UTF-8") as infile:
+            tweets = [json.loads(line) for line, _ in zip(infile, range(10000))]
+    else:
+        tweets = [{
+            "id_str": "896000000000000001", "text": "sample", "favorite_count": 0,
+            "retweet_count": 12, "created_at": "Mon Aug 14 02:00:00 +0000 2017",
+            "in_reply_to_status_id_str": None, "in_reply_to_user_id_str": None,
+            "in_reply_to_screen_name": None, "quoted_status_id": 896000000000000000,
+            "user": {"id_str": "10000", "screen_name": "user", "name": "User",
+                     "verified": False, "followers_count": 10, "friends_count": 3,
+                     "description": None, "location": "VA",
+                     "created_at": "Mon Jan 01 00:00:00 +0000 2007"},
+        }]
+
+    checks = [("tweet", TWEET_SCHEMA, True, lambda t: t), ("user", USER_SCHEMA, False, lambda t: t["user"])]
+    for label, schema, drop_falsy, element in checks:
+        extractor = compile_schema(schema, drop_falsy)
+        for tweet in tweets:
+            assert extractor(element(tweet)) == interpret_schema(schema, drop_falsy, element(tweet))
+        number = max(1, 200000//len(tweets))
+        interpreted = timeit.timeit(lambda: [interpret_schema(schema, drop_falsy, element(t)) for t in tweets], number=number)
+        compiled = timeit.timeit(lambda: [extractor(element(t)) for t in tweets], number=number)
+        records = number*len(tweets)
+        print(label, "schema:",
+              round(interpreted/records*1e9), "ns/record interpreted,",
+              round(compiled/records*1e9), "ns/record compiled",
+              "("+str(round(interpreted/compiled,1))+"x)")
@@ -0,0 +1,169 @@
+"""
+Sort list generation
+
+The sort_<order>_<name>.json files list every display tweet id in one of
+the SORT_ORDERS. Rather than a full sorted() over the display tweets per
+order (re-running int() and the user lookup inside every key), the sort
+keys are pulled out once into int64 columns and each ordering is
+computed from those: with NumPy when it's installed, otherwise with
+sorted() over indexes using the columns' C-level __getitem__ as key.
+
+Both paths are stable, so ties keep insertion order exactly like the
+original sorted() calls did.
+
+For the viewer, each order can also be split into fixed-size pages with a
+small header (sort_pages_<name>.json) holding the total, the page files
+and each page's first/last id and sort key, and the first N tweets of
+each order can be written with their records as top_<order>_<name>.json,
+so the first page doesn't depend on the size of the corpus.
+
+Orderings can also be written as packed binary index files
+(sort_<order>_<name>.bin): little-endian uint32 positions of each tweet in
+the chunk files, i.e. tweet k of the order lives in chunk index // BOX_SIZE
+at position index % BOX_SIZE.
+"""
+
+import sys
+import json
+from array import array
+from itertools import islice
+
+from store import iter_batches
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SORT_ORDERS = ["chrono", "favs", "retweets", "followers"]
+# the column each order is primarily sorted on, reported in page headers
+SORT_KEYS = {"chrono":"id", "favs":"favorite_count", "retweets":"retweet_count", "followers":"followers_count"}
+
+'''
+Collect (id, favorite_count, retweet_count, created_at, followers_count)
+sort keys into int64 columns in a single pass
+'''
+def sort_columns(sort_keys):
+    ids, favs, retweets, created_at, followers = array("q"), array("q"), array("q"), array("q"), array("q")
+    for twid, favorite_count, retweet_count, tweet_created_at, followers_count in sort_keys:
+        ids.append(int(twid))
+        favs.append(int(favorite_count))
+        retweets.append(int(retweet_count))
+        created_at.append(int(tweet_created_at))
+        followers.append(int(followers_count))
+    return {"id":ids, "favorite_count":favs, "retweet_count":retweets, "created_at":created_at, "followers_count":followers}
+
+'''
+Return the columns of the tweets at positions, in that order
+'''
+def subset_columns(columns, positions):
+    return {key:array("q", map(column.__getitem__, positions)) for key, column in columns.items()}
+
+'''
+Return {order: permutation of tweet indexes} for every sort order:
+chrono by id ascending, favs and retweets by count descending, followers
+by the author's followers descending and then oldest first
+'''
+def sort_permutations(columns):
+    if numpy is not None:
+        ids, favs, retweets, created_at, followers = (numpy.frombuffer(columns[key], dtype=numpy.int64) for key in
+            ["id", "favorite_count", "retweet_count", "created_at", "followers_count"])
+        return {
+            "chrono": numpy.argsort(ids, kind="stable"),
+            "favs": numpy.argsort(-favs, kind="stable"),
+            "retweets": numpy.argsort(-retweets, kind="stable"),
+            # lexsort sorts by the last key first
+            "followers": numpy.lexsort((created_at, -followers)),
+        }
+    indexes = range(len(columns["id"]))
+    # reverse=True keeps ties in their original order, like the old sorts
+    by_created = sorted(indexes, key=columns["created_at"].__getitem__)
+    return {
+        "chrono": sorted(indexes, key=columns["id"].__getitem__),
+        "favs": sorted(indexes, key=columns["favorite_count"].__getitem__, reverse=True),
+        "retweets": sorted(indexes, key=columns["retweet_count"].__getitem__, reverse=True),
+        "followers": sorted(by_created, key=columns["followers_count"].__getitem__, reverse=True),
+    }
+
+'''
+Yield the tweet id strings of a permutation
+'''
+def iter_sorted_ids(columns, permutation):
+    if numpy is not None:
+        ids = numpy.frombuffer(columns["id"], dtype=numpy.int64)[permutation].tolist()
+    else:
+        ids = map(columns["id"].__getitem__, permutation)
+    return map(str, ids)
+
+'''
+Map a permutation of insertion-order indexes to chunk positions. Chunks
+written in id order (ID_RANGE_INDEX) hold each tweet at its chrono rank.
+'''
+def chunk_positions(permutations, order, by_id):
+    permutation = permutations[order]
+    if not by_id:
+        return permutation
+    chrono = permutations["chrono"]
+    if numpy is not None:
+        rank = numpy.empty(len(chrono), dtype=numpy.int64)
+        rank[chrono] = numpy.arange(len(chrono))
+        return rank[permutation]
+    rank = array("q", bytes(8*len(chrono)))
+    for position, index in enumerate(chrono):
+        rank[index] = position
+    return [rank[index] for index in permutation]
+
+'''
+Pack positions as little-endian uint32 bytes
+'''
+def pack_positions(positions):
+    if numpy is not None:
+        return numpy.asarray(positions, dtype="<u4").tobytes()
+    packed = array("I", positions)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return packed.tobytes()
+
+'''
+Write chunk positions as packed little-endian uint32
+'''
+def write_index_file(positions, path):
+    with open(path, "wb") as outfile:
+        outfile.write(pack_positions(positions))
+
+'''
+Yield the primary sort key values of a permutation
+'''
+def iter_sorted_keys(columns, order, permutation):
+    column = columns[SORT_KEYS[order]]
+    if numpy is not None:
+        return iter(numpy.frombuffer(column, dtype=numpy.int64)[permutation].tolist())
+    return map(column.__getitem__, permutation)
+
+'''
+Write one order as page_size id arrays named <prefix>-000.json, ... in
+output_dir and return its page header: page files with the first/last id
+and sort key of each page. Ids and keys are strings, since tweet ids
+don't fit in a JavaScript number.
+'''
+def write_sort_pages(columns, permutations, order, page_size, output_dir, prefix):
+    header = {"pages":[], "first_ids":[], "last_ids":[], "first_keys":[], "last_keys":[]}
+    ids = iter_sorted_ids(columns, permutations[order])
+    keys = iter_sorted_keys(columns, order, permutations[order])
+    for page_ids in iter_batches(ids, page_size):
+        page_keys = [next(keys) for i in range(len(page_ids))]
+        page_fn = prefix+"-"+str(len(header["pages"])).zfill(3)+".json"
+        with open(output_dir+page_fn, "w", encoding="UTF-8") as outfile:
+            json.dump(page_ids, outfile)
+        header["pages"].append(page_fn)
+        header["first_ids"].append(page_ids[0])
+        header["last_ids"].append(page_ids[-1])
+        header["first_keys"].append(str(page_keys[0]))
+        header["last_keys"].append(str(page_keys[-1]))
+    return header
+
+'''
+Return the first n tweet ids of an order
+'''
+def top_ids(columns, permutations, order, n):
+    return list(islice(iter_sorted_ids(columns, permutations[order][:n]), n))
@@ -0,0 +1,475 @@
+"""
+Display tweet / user stores
+
+process.py keeps every display tweet, user, retweet and quote retweet
+until the output files are written. MemoryStore keeps them in plain
+dictionaries, which is fastest but grows with the input. CompactStore
+keeps them in memory too, but as __slots__ records with retweets held in
+array columns, which takes a fraction of the space. SqliteStore
+keeps them in a local sqlite3 database instead, so memory use stays flat
+and the larger multi-day datasets can be processed; the output files are
+the same either way.
+
+Both stores support the same operations:
+    has_tweet / add_tweet           first-seen insert-if-absent
+    append_retweets                 append to a parent's retweets
+    add_quote_retweets              collect QRT ids for a parent
+    get_user / put_user             last-seen users, keeping first position
+    iter_tweet_chunks               chunks of display tweets with quote
+                                    retweets attached, in insertion or id order
+    iter_user_chunks                chunks of users, in insertion or id order
+    iter_sort_keys                  (id, favorite_count, retweet_count,
+                                    created_at, followers_count) per tweet,
+                                    in insertion order (see sort_lists.py)
+"""
+
+import os
+import sys
+import json
+import sqlite3
+from array import array
+from collections import defaultdict
+from itertools import islice
+
+# sqlite page cache per connection, in KiB
+SQLITE_CACHE_KIB = 262144
+
+'''
+Yield chunk_size dictionaries of input_dict's items, in insertion order or
+ordered numerically by id
+'''
+def chunk_dictionary(input_dict, chunk_size, by_id=False):
+    if by_id:
+        for keys in iter_batches(sorted(input_dict, key=int), chunk_size):
+            yield {key:input_dict[key] for key in keys}
+        return
+    dict_iterator = iter(input_dict.items())
+    for i in range(0, len(input_dict), chunk_size):
+        yield dict(islice(dict_iterator, chunk_size))
+
+def iter_batches(iterable, batch_size):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, batch_size))
+
+'''
+Open the store for a run. backend is "memory", "compact" or "sqlite".
+CompactStore needs the display tweet fields in output order. A sqlite
+store at path is recreated from scratch unless incremental is set, in
+which case an existing one is reopened and tracks what changed.
+'''
+def open_store(backend, path=None, tweet_fields=None, incremental=False):
+    if backend == "memory":
+        return MemoryStore()
+    if backend == "compact":
+        return CompactStore(tweet_fields)
+    if backend == "sqlite":
+        if incremental:
+            return SqliteStore(path, track_changes=True)
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(path+suffix):
+                os.remove(path+suffix)
+        return SqliteStore(path)
+    if incremental:
+        raise ValueError("incremental runs need the sqlite store backend")
+    raise ValueError("unknown store backend: "+str(backend))
+
+
+'''
+Dictionary-backed store
+'''
+class MemoryStore:
+    def __init__(self):
+        self.tweets = {}
+        self.users = {}
+        self.quote_retweets = defaultdict(list)
+
+    def has_tweet(self, twid):
+        return twid in self.tweets
+
+    def add_tweet(self, twid, tweet):
+        if twid not in self.tweets:
+            self.tweets[twid] = tweet
+
+    def append_retweets(self, parent_id, retweets):
+        parent = self.tweets[parent_id]
+        if "retweets" not in parent:
+            parent["retweets"] = []
+        parent["retweets"].extend(retweets)
+
+    def add_quote_retweets(self, parent_id, qrt_ids):
+        self.quote_retweets[parent_id].extend(qrt_ids)
+
+    def get_user(self, userid):
+        return self.users.get(userid)
+
+    def put_user(self, userid, user):
+        self.users[userid] = user
+
+    def tweet_count(self):
+        return len(self.tweets)
+
+    def user_count(self):
+        return len(self.users)
+
+    def iter_tweet_chunks(self, chunk_size, by_id=False, chunk_indexes=None):
+        for i, chunk in enumerate(chunk_dictionary(self.tweets, chunk_size, by_id)):
+            if chunk_indexes is None or i in chunk_indexes:
+                yield self.display_tweets(chunk)
+
+    def iter_user_chunks(self, chunk_size, by_id=False, chunk_indexes=None):
+        for i, chunk in enumerate(chunk_dictionary(self.users, chunk_size, by_id)):
+            if chunk_indexes is None or i in chunk_indexes:
+                yield chunk
+
+    def get_tweets(self, twids):
+        return self.display_tweets({twid:self.tweets[twid] for twid in twids})
+
+    '''
+    Turn stored records into display tweets with quote retweets attached
+    '''
+    def display_tweets(self, tweets):
+        tweets = {twid:self.tweet_dict(tweet) for twid, tweet in tweets.items()}
+        # append quote retweet info to parent tweets
+        for twid, tweet in tweets.items():
+            qrt_ids = self.quote_retweets.get(twid)
+            if qrt_ids:
+                tweet["quote_retweets"] = qrt_ids
+                tweet["quote_retweet_count"] = len(qrt_ids)
+        return tweets
+
+    def tweet_dict(self, tweet):
+        return tweet
+
+    def iter_sort_keys(self):
+        users = self.users
+        for tweet in self.tweets.values():
+            yield (tweet.get("id",0), tweet.get("favorite_count",0), tweet.get("retweet_count",0),
+                   tweet.get("created_at",0), users[tweet["user_id"]]["followers_count"])
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+'''
+Column-oriented retweet list: user ids and timestamps in parallel int64
+arrays and interned screen names, instead of a tuple of fresh strings per
+retweet. Twitter id_str values are canonical decimals, so str(int(id))
+gives the original string back at write time.
+'''
+class RetweetColumns:
+    __slots__ = ("user_ids", "user_screen_names", "created_at")
+
+    def __init__(self):
+        self.user_ids = array("q")
+        self.user_screen_names = []
+        self.created_at = array("q")
+
+    def extend(self, retweets):
+        for user_id, user_screen_name, created_at in retweets:
+            self.user_ids.append(int(user_id))
+            self.user_screen_names.append(sys.intern(user_screen_name))
+            self.created_at.append(created_at)
+
+    def to_list(self):
+        return [(str(user_id), user_screen_name, created_at) for user_id, user_screen_name, created_at
+                in zip(self.user_ids, self.user_screen_names, self.created_at)]
+
+# marks a field a record doesn't have
+MISSING = object()
+
+# display tweet fields holding short, highly repeated strings
+INTERNED_FIELDS = ["user_screen_name", "in_reply_to_screen_name", "local_date"]
+
+'''
+Build a __slots__ record class for display tweets. fields are the display
+tweet keys in output order; absent keys are left unset, like the keys the
+schema drops from the dictionaries. get/__getitem__ let MemoryStore read
+records of either kind.
+'''
+def compact_tweet_class(fields):
+    fields = tuple(fields)
+
+    class CompactTweet:
+        __slots__ = fields + ("retweets",)
+
+        def __init__(self, tweet):
+            for key, value in tweet.items():
+                if key in INTERNED_FIELDS and isinstance(value, str):
+                    value = sys.intern(value)
+                elif key == "hashtags":
+                    value = tuple(sys.intern(hashtag) for hashtag in value)
+                elif key == "retweets":
+                    columns = RetweetColumns()
+                    columns.extend(value)
+                    value = columns
+                setattr(self, key, value)
+
+        def get(self, key, default=None):
+            return getattr(self, key, default)
+
+        def __getitem__(self, key):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+
+        def to_dict(self):
+            tweet = {}
+            for field in fields:
+                value = getattr(self, field, MISSING)
+                if value is not MISSING:
+                    tweet[field] = list(value) if field == "hashtags" else value
+            if hasattr(self, "retweets"):
+                tweet["retweets"] = self.retweets.to_list()
+            return tweet
+
+    return CompactTweet
+
+'''
+In-memory store using compact_tweet_class records, serialized back to the
+display tweet dictionaries only when chunks are written
+'''
+class CompactStore(MemoryStore):
+    def __init__(self, tweet_fields):
+        MemoryStore.__init__(self)
+        self.record_class = compact_tweet_class(tweet_fields)
+
+    def add_tweet(self, twid, tweet):
+        if twid not in self.tweets:
+            self.tweets[twid] = self.record_class(tweet)
+
+    def append_retweets(self, parent_id, retweets):
+        parent = self.tweets[parent_id]
+        if not hasattr(parent, "retweets"):
+            parent.retweets = RetweetColumns()
+        parent.retweets.extend(retweets)
+
+    def tweet_dict(self, tweet):
+        return tweet.to_dict()
+
+
+'''
+sqlite3-backed store. Records are kept as JSON text next to the integer
+columns the sort orders need; retweets and quote retweets live in their
+own tables clustered by parent id. seq columns keep insertion order.
+'''
+class SqliteStore:
+    def __init__(self, path, track_changes=False):
+        self.track_changes = track_changes
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("PRAGMA cache_size = -"+str(SQLITE_CACHE_KIB))
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS tweets (
+                seq INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                record TEXT NOT NULL,
+                id_num INTEGER,
+                favorite_count INTEGER,
+                retweet_count INTEGER,
+                created_at INTEGER,
+                user_id TEXT
+            );
+            CREATE TABLE IF NOT EXISTS retweets (
+                parent_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                user_id TEXT,
+                user_screen_name TEXT,
+                created_at INTEGER,
+                PRIMARY KEY (parent_id, seq)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS quote_retweets (
+                parent_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                id TEXT NOT NULL,
+                PRIMARY KEY (parent_id, seq)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS users (
+                seq INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                record TEXT NOT NULL,
+                followers_count INTEGER
+            );
+            -- incremental runs: input files consumed so far, and the
+            -- tweets / users changed since the output was last written
+            CREATE TABLE IF NOT EXISTS inputs (
+                filename TEXT PRIMARY KEY,
+                size INTEGER,
+                fingerprint TEXT,
+                offset INTEGER,
+                lines INTEGER,
+                end_fingerprint TEXT
+            );
+            CREATE TABLE IF NOT EXISTS changed_tweets (id TEXT PRIMARY KEY) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS changed_users (id TEXT PRIMARY KEY) WITHOUT ROWID;
+        """)
+        # continue the retweet / quote retweet sequences of an existing file
+        self.retweet_seq = self.db.execute("SELECT coalesce(max(seq), 0) FROM retweets").fetchone()[0]
+        self.quote_seq = self.db.execute("SELECT coalesce(max(seq), 0) FROM quote_retweets").fetchone()[0]
+
+    def has_tweet(self, twid):
+        return self.db.execute("SELECT 1 FROM tweets WHERE id = ?", (twid,)).fetchone() is not None
+
+    def add_tweet(self, twid, tweet):
+        retweets = tweet.get("retweets")
+        if retweets is not None:
+            tweet = {k:v for k,v in tweet.items() if k != "retweets"}
+        inserted = self.db.execute(
+            "INSERT OR IGNORE INTO tweets (id, record, id_num, favorite_count, retweet_count, created_at, user_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (twid, json.dumps(tweet), int(tweet.get("id",0)), int(tweet.get("favorite_count",0)),
+             int(tweet.get("retweet_count",0)), int(tweet.get("created_at",0)), tweet.get("user_id"))).rowcount
+        if inserted:
+            self.mark_changed("changed_tweets", twid)
+            if retweets:
+                self.append_retweets(twid, retweets)
+
+    def append_retweets(self, parent_id, retweets):
+        rows = []
+        for user_id, user_screen_name, created_at in retweets:
+            self.retweet_seq += 1
+            rows.append((parent_id, self.retweet_seq, user_id, user_screen_name, created_at))
+        self.db.executemany("INSERT INTO retweets VALUES (?, ?, ?, ?, ?)", rows)
+        self.mark_changed("changed_tweets", parent_id)
+
+    def add_quote_retweets(self, parent_id, qrt_ids):
+        rows = []
+        for qrt_id in qrt_ids:
+            self.quote_seq += 1
+            rows.append((parent_id, self.quote_seq, qrt_id))
+        self.db.executemany("INSERT INTO quote_retweets VALUES (?, ?, ?)", rows)
+        self.mark_changed("changed_tweets", parent_id)
+
+    def get_user(self, userid):
+        row = self.db.execute("SELECT record FROM users WHERE id = ?", (userid,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put_user(self, userid, user):
+        # the upsert keeps seq, i.e. the user's first-seen position
+        self.db.execute(
+            "INSERT INTO users (id, record, followers_count) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET record = excluded.record, followers_count = excluded.followers_count",
+            (userid, json.dumps(user), int(user["followers_count"])))
+        self.mark_changed("changed_users", userid)
+
+    def mark_changed(self, table, id):
+        if self.track_changes:
+            self.db.execute("INSERT OR IGNORE INTO "+table+" VALUES (?)", (id,))
+
+    def tweet_count(self):
+        return self.db.execute("SELECT count(*) FROM tweets").fetchone()[0]
+
+    def user_count(self):
+        return self.db.execute("SELECT count(*) FROM users").fetchone()[0]
+
+    def iter_tweet_chunks(self, chunk_size, by_id=False, chunk_indexes=None):
+        for rows in self.iter_chunk_rows("tweets", "id_num" if by_id else "seq", chunk_size, chunk_indexes):
+            yield self.display_tweets(rows)
+
+    def iter_user_chunks(self, chunk_size, by_id=False, chunk_indexes=None):
+        for rows in self.iter_chunk_rows("users", "CAST(id AS INTEGER)" if by_id else "seq", chunk_size, chunk_indexes):
+            yield {userid:json.loads(record) for userid, record in rows}
+
+    def get_tweets(self, twids):
+        placeholders = ",".join("?"*len(twids))
+        return self.display_tweets(self.db.execute(
+            "SELECT id, record FROM tweets WHERE id IN ("+placeholders+") ORDER BY seq", list(twids)).fetchall())
+
+    '''
+    Yield (id, record) row batches of a table in order. Rows are only ever
+    appended and INSERT OR IGNORE / upserts don't use up seq values, so in
+    insertion order chunk i is exactly seq i*chunk_size+1 .. (i+1)*chunk_size
+    and chunk_indexes can be read directly.
+    '''
+    def iter_chunk_rows(self, table, order, chunk_size, chunk_indexes):
+        if chunk_indexes is None:
+            yield from iter_batches(self.db.execute("SELECT id, record FROM "+table+" ORDER BY "+order), chunk_size)
+            return
+        if order != "seq":
+            raise ValueError("chunk_indexes need insertion-ordered chunks")
+        for i in sorted(chunk_indexes):
+            yield self.db.execute("SELECT id, record FROM "+table+" WHERE seq > ? AND seq <= ? ORDER BY seq",
+                                  (i*chunk_size, (i+1)*chunk_size)).fetchall()
+
+    '''
+    Turn (id, record) rows into display tweets with their retweets and quote
+    retweets attached
+    '''
+    def display_tweets(self, rows):
+        tweets = {twid:json.loads(record) for twid, record in rows}
+        placeholders = ",".join("?"*len(tweets))
+        for parent_id, user_id, user_screen_name, created_at in self.db.execute(
+                "SELECT parent_id, user_id, user_screen_name, created_at FROM retweets "
+                "WHERE parent_id IN ("+placeholders+") ORDER BY parent_id, seq", list(tweets)):
+            parent = tweets[parent_id]
+            if "retweets" not in parent:
+                parent["retweets"] = []
+            parent["retweets"].append((user_id, user_screen_name, created_at))
+        for parent_id, qrt_id in self.db.execute(
+                "SELECT parent_id, id FROM quote_retweets "
+                "WHERE parent_id IN ("+placeholders+") ORDER BY parent_id, seq", list(tweets)):
+            parent = tweets[parent_id]
+            if "quote_retweets" not in parent:
+                parent["quote_retweets"] = []
+            parent["quote_retweets"].append(qrt_id)
+            parent["quote_retweet_count"] = len(parent["quote_retweets"])
+        return tweets
+
+    '''
+    Yield the ids of a table ("tweets" or "users") in insertion order
+    '''
+    def iter_ids(self, table):
+        return (id for id, in self.db.execute("SELECT id FROM "+table+" ORDER BY seq"))
+
+    '''
+    Return the insertion-ordered chunk indexes holding tweets or users
+    changed since the last clear_changes(), or None if seq has gaps and
+    chunks can't be located by seq
+    '''
+    def changed_chunks(self, table, chunk_size):
+        row_count, max_seq = self.db.execute("SELECT count(*), coalesce(max(seq), 0) FROM "+table).fetchone()
+        if row_count != max_seq:
+            return None
+        return set(i for i, in self.db.execute(
+            "SELECT DISTINCT (t.seq-1)/? FROM changed_"+table+" c JOIN "+table+" t ON t.id = c.id", (chunk_size,)))
+
+    def clear_changes(self):
+        self.db.execute("DELETE FROM changed_tweets")
+        self.db.execute("DELETE FROM changed_users")
+        self.db.commit()
+
+    '''
+    The recorded (size, fingerprint, offset, lines, end_fingerprint) of an
+    input file, or None
+    '''
+    def get_input(self, filename):
+        return self.db.execute("SELECT size, fingerprint, offset, lines, end_fingerprint FROM inputs WHERE filename = ?",
+                               (filename,)).fetchone()
+
+    def set_input(self, filename, size, fingerprint, offset, lines, end_fingerprint=None):
+        self.db.execute("INSERT OR REPLACE INTO inputs (filename, size, fingerprint, offset, lines, end_fingerprint) "
+                        "VALUES (?, ?, ?, ?, ?, ?)", (filename, size, fingerprint, offset, lines, end_fingerprint))
+
+    def iter_inputs(self):
+        return self.db.execute("SELECT filename, size, fingerprint, offset, lines, end_fingerprint FROM inputs ORDER BY filename")
+
+    def iter_sort_keys(self):
+        return self.db.execute(
+            "SELECT t.id, t.favorite_count, t.retweet_count, t.created_at, u.followers_count "
+            "FROM tweets t JOIN users u ON u.id = t.user_id ORDER BY t.seq")
+
+    def flush(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,70 @@
+"""
+Twitter created_at parsing
+
+Tweets and users carry created_at strings in Twitter's fixed v1.1 format,
+e.g. "Mon Aug 14 02:00:00 +0000 2017". Going through
+datetime.strptime(..., "%a %b %d %H:%M:%S %z %Y"), astimezone and
+strftime for every record is a large share of the per-line cost, and a
+one-day dump only holds a few tens of thousands of distinct timestamps,
+so tweet timestamps are parsed by slicing the fixed-width fields and
+memoized in a bounded LRU cache.
+
+Strings that don't match the fixed layout fall back to strptime.
+
+tests/test_twitter_time.py checks the fast path against strptime for both
+EDT and EST offsets:
+    python -m pytest tests/test_twitter_time.py
+"""
+
+from calendar import timegm
+from datetime import datetime
+from functools import lru_cache
+import time
+
+DATE_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+# enough for every second of a day's worth of tweets
+CACHE_SIZE = 1 << 17
+
+MONTHS = {month: i+1 for i, month in enumerate(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"])}
+
+'''
+Return (epoch, utc offset in seconds) for a created_at string
+'''
+def parse_fields(created_at):
+    # "Mon Aug 14 02:00:00 +0000 2017"
+    #  0   4   8  11 14 17 20    26
+    if (len(created_at) == 30 and created_at[3] == " " and created_at[10] == " "
+            and created_at[19] == " " and created_at[25] == " "
+            and created_at[20] in "+-" and created_at[4:7] in MONTHS):
+        try:
+            offset = int(created_at[21:23])*3600 + int(created_at[23:25])*60
+            if created_at[20] == "-":
+                offset = -offset
+            epoch = timegm((int(created_at[26:30]), MONTHS[created_at[4:7]], int(created_at[8:10]),
+                            int(created_at[11:13]), int(created_at[14:16]), int(created_at[17:19]))) - offset
+            return epoch, offset
+        except ValueError:
+            pass
+    dt = datetime.strptime(created_at, DATE_FORMAT)
+    return int(dt.timestamp()), int(dt.utcoffset().total_seconds())
+
+'''
+Return (epoch, local_date) for a tweet created_at string, local_date being
+the %Y-%m-%d date at tz_offset hours from UTC
+'''
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_created_at(created_at, tz_offset):
+    epoch, offset = parse_fields(created_at)
+    local_date = time.strftime("%Y-%m-%d", time.gmtime(epoch + tz_offset*3600))
+    return epoch, local_date
+
+'''
+Return (epoch, created_year) for a user created_at string, the year being
+the one written in the string like strftime('%Y'). Account creation times
+are close to unique per user, so this is not cached.
+'''
+def parse_account_created_at(created_at):
+    epoch, offset = parse_fields(created_at)
+    return epoch, time.strftime("%Y", time.gmtime(epoch + offset))
+
@@ -0,0 +1,302 @@
+"""
+User text corpus
+
+Pipeline sink (see pipeline.py) behind process_user_text.py: collects the
+user-written text of every display tweet and user for downstream NLP.
+
+tw_usertext.json gets the text of every first-seen tweet that isn't a
+retweet, newlines replaced, one per line. u_usertext.json gets the
+non-empty user schema fields (all but id) of every user, last-seen, one
+user per line. Every item is followed by a space, like the original
+writer did.
+
+UserTextSink keeps every text until the end of the run. For the full
+dumps StreamingUserTextSink writes the corpus while the input is read
+instead: a text is written the first time its content is seen, checked
+against a packed table of 64-bit content hashes (12-24 bytes a text, see
+HashSet), so duplicate tweets and tweets with identical text are written
+once and a user is written again only when their text changed. The corpus can also be split into files of a
+fixed number of lines (tw_usertext-000.json, ...) for parallel jobs.
+"""
+
+from array import array
+from hashlib import blake2b
+
+from schema import compile_schema
+
+# output buffer per corpus file
+WRITE_BUFFER = 1 << 20
+# initial slots of a HashSet, a power of 2
+HASH_TABLE_SIZE = 1 << 16
+
+'''
+Extraction shared by the sink and its parallel shards
+'''
+class UserTextExtractor:
+    def __init__(self, tweet_schema, user_schema):
+        self.extractor_args = (tweet_schema, user_schema)
+        self.extract_tweet_fields = compile_schema(tweet_schema, drop_falsy=True, name="extract_tweet_fields")
+        self.extract_user_fields = compile_schema(user_schema, drop_falsy=True, name="extract_user_fields")
+        self.user_text_fields = [k for k in user_schema.keys() if k != "id"]
+
+    '''
+    The key paths read from a tweet (see decode.py)
+    '''
+    def decode_paths(self):
+        tweet_schema, user_schema = self.extractor_args
+        return list(tweet_schema.values()) + [["user"]+path for path in user_schema.values()]
+
+    '''
+    Walk a tweet and all upstream RT/QRT, keeping the text line of tweets
+    not seen before and the latest text line of every user
+    '''
+    def extract_user_texts(self, tweet):
+        display_tweet = self.extract_tweet_fields(tweet)
+        if "retweeted_status_id" not in display_tweet:
+            self.add_tweet_text(display_tweet["id"], display_tweet["text"].replace("\n"," ")+"\n ")
+
+        display_user = self.extract_user_fields(tweet["user"])
+        user_text = ""
+        for k in self.user_text_fields:
+            if k in display_user:
+                user_text += display_user[k].replace("\n"," ")+" "
+        self.add_user_text(display_user["id"], user_text+"\n ")
+
+        if "retweeted_status" in tweet:
+            self.extract_user_texts(tweet["retweeted_status"])
+        if "quoted_status" in tweet:
+            self.extract_user_texts(tweet["quoted_status"])
+
+    def process(self, tweet):
+        self.extract_user_texts(tweet)
+
+'''
+Texts kept by id until the end: tweets first-seen, users last-seen
+'''
+class UserTextCollector(UserTextExtractor):
+    def __init__(self, *extractor_args):
+        UserTextExtractor.__init__(self, *extractor_args)
+        self.tweet_texts = {}
+        self.user_texts = {}
+
+    def add_tweet_text(self, twid, text):
+        if twid not in self.tweet_texts:
+            self.tweet_texts[twid] = text
+
+    def add_user_text(self, userid, text):
+        self.user_texts[userid] = text
+
+'''
+Worker side of sharded ingestion: texts of one byte range
+'''
+class UserTextShard(UserTextCollector):
+    def result(self):
+        return self.tweet_texts, self.user_texts
+
+'''
+The user text sink
+'''
+class UserTextSink(UserTextCollector):
+    def __init__(self, tweet_schema, user_schema, output_dir="./output/"):
+        UserTextCollector.__init__(self, tweet_schema, user_schema)
+        self.output_dir = output_dir
+
+    def resume_point(self, filename, path):
+        return 0, 0
+
+    def checkpoint(self, filename, path, offset, lines, at_end=False):
+        pass
+
+    def shard_spec(self):
+        return UserTextShard, self.extractor_args
+
+    '''
+    Merge one shard's texts, in input order: tweets first-seen, users
+    last-seen
+    '''
+    def merge(self, shard_result):
+        shard_tweet_texts, shard_user_texts = shard_result
+        for twid, text in shard_tweet_texts.items():
+            if twid not in self.tweet_texts:
+                self.tweet_texts[twid] = text
+        self.user_texts.update(shard_user_texts)
+
+    def finish(self):
+        with open(self.output_dir+"tw_usertext.json", "w", encoding="UTF-8") as outfile:
+            for text in self.tweet_texts.values():
+                outfile.write(text)
+
+        with open(self.output_dir+"u_usertext.json", "w", encoding="UTF-8") as outfile:
+            for text in self.user_texts.values():
+                outfile.write(text)
+
+'''
+64-bit content hash of a text. Built-in hash() is salted per process, so
+it can't be compared across parallel workers.
+'''
+def text_hash(text):
+    return int.from_bytes(blake2b(text.encode("UTF-8"), digest_size=8).digest(), "little")
+
+'''
+Set of 64-bit hashes packed into an open-addressing table: an array("Q")
+of slots probed linearly from the hash's low bits, 0 marking an empty
+slot. Kept between a third and two thirds full, that is 12-24 bytes a
+hash, where a set of ints takes 60+.
+'''
+class HashSet:
+    def __init__(self, capacity=HASH_TABLE_SIZE):
+        self.table = array("Q", bytes(8*capacity))
+        self.mask = capacity - 1
+        self.count = 0
+        # 0 can't go in the table, so it's tracked on its own
+        self.has_zero = False
+
+    def __contains__(self, hash):
+        if not hash:
+            return self.has_zero
+        table = self.table
+        i = hash & self.mask
+        while True:
+            value = table[i]
+            if value == hash:
+                return True
+            if not value:
+                return False
+            i = (i+1) & self.mask
+
+    def add(self, hash):
+        if not hash:
+            self.has_zero = True
+            return
+        table = self.table
+        i = hash & self.mask
+        while True:
+            value = table[i]
+            if value == hash:
+                return
+            if not value:
+                break
+            i = (i+1) & self.mask
+        table[i] = hash
+        self.count += 1
+        if 3*self.count > 2*len(table):
+            self.resize(2*len(table))
+
+    def resize(self, capacity):
+        old_table = self.table
+        self.table = array("Q", bytes(8*capacity))
+        self.mask = capacity - 1
+        self.count = 0
+        for hash in old_table:
+            if hash:
+                self.add(hash)
+
+    def __len__(self):
+        return self.count + self.has_zero
+
+'''
+Buffered writer for one corpus, skipping texts already written and
+starting a new <name>-000.json, ... file every shard_lines texts when
+shard_lines is set
+'''
+class CorpusWriter:
+    def __init__(self, output_dir, name, shard_lines=0):
+        self.output_dir = output_dir
+        self.name = name
+        self.shard_lines = shard_lines
+        self.seen = HashSet()
+        self.outfile = None
+        self.file_count = 0
+        self.line_count = 0
+
+    def write(self, text, hash=None):
+        if hash is None:
+            hash = text_hash(text)
+        if hash in self.seen:
+            return
+        self.seen.add(hash)
+        if self.outfile is None or (self.shard_lines and self.line_count == self.shard_lines):
+            self.open_next()
+        self.outfile.write(text)
+        self.line_count += 1
+
+    def open_next(self):
+        if self.outfile is not None:
+            self.outfile.close()
+        if self.shard_lines:
+            filename = self.name+"-"+str(self.file_count).zfill(3)+".json"
+        else:
+            filename = self.name+".json"
+        self.outfile = open(self.output_dir+filename, "w", WRITE_BUFFER, "UTF-8")
+        self.file_count += 1
+        self.line_count = 0
+
+    def close(self):
+        # an empty corpus still gets its (first) file
+        if self.outfile is None:
+            self.open_next()
+        self.outfile.close()
+
+'''
+Worker side of streaming sharded ingestion: the (hash, text) pairs of one
+byte range in input order, duplicates within the range dropped
+'''
+class StreamingUserTextShard(UserTextExtractor):
+    def __init__(self, *extractor_args):
+        UserTextExtractor.__init__(self, *extractor_args)
+        # tweet and user texts are deduplicated separately
+        self.seen_tweet_texts = set()
+        self.seen_user_texts = set()
+        self.tweet_texts = []
+        self.user_texts = []
+
+    def add_text(self, texts, seen, text):
+        hash = text_hash(text)
+        if hash not in seen:
+            seen.add(hash)
+            texts.append((hash, text))
+
+    def add_tweet_text(self, twid, text):
+        self.add_text(self.tweet_texts, self.seen_tweet_texts, text)
+
+    def add_user_text(self, userid, text):
+        self.add_text(self.user_texts, self.seen_user_texts, text)
+
+    def result(self):
+        return self.tweet_texts, self.user_texts
+
+'''
+The streaming user text sink: texts are written as they're read, once per
+distinct content
+'''
+class StreamingUserTextSink(UserTextExtractor):
+    def __init__(self, tweet_schema, user_schema, output_dir="./output/", shard_lines=0):
+        UserTextExtractor.__init__(self, tweet_schema, user_schema)
+        self.tweet_corpus = CorpusWriter(output_dir, "tw_usertext", shard_lines)
+        self.user_corpus = CorpusWriter(output_dir, "u_usertext", shard_lines)
+
+    def add_tweet_text(self, twid, text):
+        self.tweet_corpus.write(text)
+
+    def add_user_text(self, userid, text):
+        self.user_corpus.write(text)
+
+    def resume_point(self, filename, path):
+        return 0, 0
+
+    def checkpoint(self, filename, path, offset, lines, at_end=False):
+        pass
+
+    def shard_spec(self):
+        return StreamingUserTextShard, self.extractor_args
+
+    def merge(self, shard_result):
+        shard_tweet_texts, shard_user_texts = shard_result
+        for hash, text in shard_tweet_texts:
+            self.tweet_corpus.write(text, hash)
+        for hash, text in shard_user_texts:
+            self.user_corpus.write(text, hash)
+
+    def finish(self):
+        self.tweet_corpus.close()
+        self.user_corpus.close()
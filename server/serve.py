@@ -0,0 +1,460 @@
+"""
+Local query service over the processed output
+
+The viewer downloads chunks and filters them in the browser. This serves
+the same output/ files over HTTP instead, answering the heavy queries
+server side: the id lookup, sort lists and Lunr index (from
+lunr/build_index.py, single or sharded) are loaded once at startup, and
+chunk files are loaded on demand into an LRU cache of CACHE_CHUNKS parsed
+chunks, so hot chunks are never read twice. Chunk files are read and
+parsed in a thread so a cold chunk doesn't hold up other requests, and
+concurrent requests for the same cold chunk share one load.
+
+Only the standard library is needed (asyncio streams and a minimal
+HTTP/1.1 GET parser); search needs the lunr package the index was built
+with. Every response is JSON:
+
+    GET /tweet/<id>                         the display tweet
+    GET /user/<id>                          the display user
+    GET /sorted/<order>?page=N&size=M       page N of a sort order's tweets
+    GET /retweeters/<id>?page=N&size=M      page N of a tweet's retweets
+    GET /search?q=<query>&page=N&size=M     page N of the Lunr matches
+
+Pages count from 0; paginated responses carry the total. Search results
+from a sharded index are ranked within each shard and interleaved (see
+search_indexes), and the scores returned are each shard's own.
+
+Every layout process.py writes can be served: ids are found through the
+per-id maps or the range manifests of ID_RANGE_INDEX, sort orders are
+read from the JSON id arrays, the sort pages (SORT_PAGE_SIZE) or the
+binary positions (SORT_FORMAT = "binary"), and with PARTITION_BY every
+partition of partitions_<name>.json is searched for an id, while
+/sorted takes the partition, e.g. &partition=2017-08-12. Run from the
+directory holding output/ after process.py (and build_index.py for
+search), with the same OUTPUT_FILENAME:
+    python server/serve.py
+"""
+
+import os
+import sys
+import json
+import asyncio
+import traceback
+from array import array
+from bisect import bisect_right
+from itertools import islice
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs, unquote
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "process"))
+from chunk_index import load_range_manifest, find_chunk
+
+try:
+    from lunr.index import Index
+except ImportError:
+    Index = None
+
+OUTPUT_DIR = "./output/"
+OUTPUT_FILENAME = "cville814"
+HOST = "127.0.0.1"
+PORT = 8000
+# parsed chunk files kept in memory
+CACHE_CHUNKS = 64
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+SORT_ORDERS = ["chrono", "favs", "retweets", "followers"]
+
+REASONS = {200:"OK", 400:"Bad Request", 404:"Not Found", 405:"Method Not Allowed", 500:"Internal Server Error",
+           503:"Service Unavailable"}
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+def load_json(filename):
+    with open(OUTPUT_DIR+filename,"r",-1,"UTF-8") as infile:
+        return json.load(infile)
+
+'''
+Load the Lunr index: every shard of index_manifest.json, or index.json.
+Returns [] when there is no index or no lunr package.
+'''
+def load_indexes():
+    if Index is None:
+        return []
+    if os.path.exists(OUTPUT_DIR+"index_manifest.json"):
+        return [Index.load(load_json(entry["file"])) for entry in load_json("index_manifest.json")["shards"]]
+    if os.path.exists(OUTPUT_DIR+"index.json"):
+        return [Index.load(load_json("index.json"))]
+    return []
+
+'''
+Parsed chunk files by filename, least recently used first
+'''
+class ChunkCache:
+    def __init__(self, size):
+        self.size = size
+        self.chunks = OrderedDict()
+        self.loading = {}
+
+    async def get(self, filename):
+        if filename in self.chunks:
+            self.chunks.move_to_end(filename)
+            return self.chunks[filename]
+        if filename not in self.loading:
+            self.loading[filename] = asyncio.get_running_loop().run_in_executor(None, load_json, filename)
+        try:
+            chunk = await self.loading[filename]
+        finally:
+            self.loading.pop(filename, None)
+        self.chunks[filename] = chunk
+        if len(self.chunks) > self.size:
+            self.chunks.popitem(last=False)
+        return chunk
+
+'''
+Output that can't be served, with what's missing
+'''
+class OutputError(Exception):
+    pass
+
+'''
+The id -> chunk filename lookup of a set of chunk files: the
+disp_twids_/disp_userids_ map, or the disp_twranges_/disp_uranges_ range
+manifest of output written with ID_RANGE_INDEX (see chunk_index.py)
+'''
+class ChunkLookup:
+    def __init__(self, map_prefix, ranges_prefix, name):
+        self.chunks = None
+        self.ranges = None
+        if os.path.exists(OUTPUT_DIR+map_prefix+name+".json"):
+            self.chunks = load_json(map_prefix+name+".json")
+        elif os.path.exists(OUTPUT_DIR+ranges_prefix+name+".json"):
+            self.ranges = load_range_manifest(OUTPUT_DIR+ranges_prefix+name+".json")
+        else:
+            raise OutputError("no id lookup for "+name+" in "+OUTPUT_DIR+": neither "+map_prefix+name+".json nor "+
+                              ranges_prefix+name+".json (ID_RANGE_INDEX); run process.py with OUTPUT_FILENAME = "+
+                              repr(OUTPUT_FILENAME)+" first")
+
+    '''
+    The chunk filename that would hold id, or None
+    '''
+    def find(self, id):
+        if self.chunks is not None:
+            return self.chunks.get(id)
+        return find_chunk(self.ranges, id) if id.isdigit() else None
+
+'''
+A sort order as the sort_<order>_<name>.json id array
+'''
+class IdSortList:
+    def __init__(self, ids):
+        self.ids = ids
+        self.total = len(ids)
+
+    async def tweets(self, tweet_files, start, stop):
+        return [await tweet_files.get_tweet(twid) for twid in self.ids[start:stop]]
+
+'''
+A sort order as the page files listed in sort_pages_<name>.json
+(SORT_PAGE_SIZE), loaded through the chunk cache
+'''
+class PagedSortList:
+    def __init__(self, page_size, total, pages):
+        self.page_size = page_size
+        self.total = total
+        self.pages = pages
+
+    async def tweets(self, tweet_files, start, stop):
+        stop = min(stop, self.total)
+        if start >= stop:
+            return []
+        ids = []
+        for page in range(start//self.page_size, (stop-1)//self.page_size+1):
+            ids += await tweet_files.cache.get(self.pages[page])
+        first = start//self.page_size*self.page_size
+        return [await tweet_files.get_tweet(twid) for twid in ids[start-first:stop-first]]
+
+'''
+A sort order as the chunk positions of sort_<order>_<name>.bin
+(SORT_FORMAT = "binary", see sort_lists.py)
+'''
+class PositionSortList:
+    def __init__(self, path):
+        self.positions = array("I")
+        with open(path, "rb") as infile:
+            self.positions.frombytes(infile.read())
+        if sys.byteorder != "little":
+            self.positions.byteswap()
+        self.total = len(self.positions)
+
+    async def tweets(self, tweet_files, start, stop):
+        return [await tweet_files.tweet_at(position) for position in self.positions[start:stop]]
+
+'''
+Load the sort lists of name: the JSON id arrays if they were written,
+otherwise the sort pages, otherwise the binary positions
+'''
+def load_sort_lists(name):
+    pages = {"orders":{}}
+    if os.path.exists(OUTPUT_DIR+"sort_pages_"+name+".json"):
+        pages = load_json("sort_pages_"+name+".json")
+    sort_lists = {}
+    for order in SORT_ORDERS:
+        sort_fn = "sort_"+order+"_"+name
+        if os.path.exists(OUTPUT_DIR+sort_fn+".json"):
+            sort_lists[order] = IdSortList(load_json(sort_fn+".json"))
+        elif order in pages["orders"]:
+            sort_lists[order] = PagedSortList(pages["page_size"], pages["total"], pages["orders"][order]["pages"])
+        elif os.path.exists(OUTPUT_DIR+sort_fn+".bin"):
+            sort_lists[order] = PositionSortList(OUTPUT_DIR+sort_fn+".bin")
+    return sort_lists
+
+'''
+One set of tweet chunk files with its id lookup and sort lists: the whole
+output, or one partition of output written with PARTITION_BY, which only
+holds ids from min_id to max_id
+'''
+class TweetFiles:
+    def __init__(self, name, cache, min_id=None, max_id=None):
+        self.name = name
+        self.cache = cache
+        self.id_range = None if min_id is None else (int(min_id), int(max_id))
+        self.lookup = ChunkLookup("disp_twids_", "disp_twranges_", name)
+        self.sort_lists = load_sort_lists(name)
+        # chunk start positions of size-targeted chunks (CHUNK_TARGET_BYTES)
+        self.chunk_starts = None
+        if os.path.exists(OUTPUT_DIR+"disp_twchunks_"+name+".json"):
+            self.chunk_starts = load_json("disp_twchunks_"+name+".json")
+        self.box_size = None
+
+    def chunk_filename(self, file_count):
+        return "disp_tw_"+self.name+"-"+str(file_count).zfill(3)+".json"
+
+    '''
+    The display tweet, or None if it isn't in these files
+    '''
+    async def find_tweet(self, twid):
+        if self.id_range is not None and not (twid.isdigit() and self.id_range[0] <= int(twid) <= self.id_range[1]):
+            return None
+        chunk_fn = self.lookup.find(twid)
+        if chunk_fn is None:
+            return None
+        return (await self.cache.get(chunk_fn)).get(twid)
+
+    async def get_tweet(self, twid):
+        tweet = await self.find_tweet(twid)
+        if tweet is None:
+            raise HTTPError(404, "no tweet "+twid)
+        return tweet
+
+    '''
+    The display tweet at a position across the chunk files in file order
+    '''
+    async def tweet_at(self, position):
+        if self.chunk_starts is not None:
+            file_count = bisect_right(self.chunk_starts, position)-1
+            index = position-self.chunk_starts[file_count]
+        else:
+            if self.box_size is None:
+                # every chunk but the last holds BOX_SIZE tweets
+                self.box_size = len(await self.cache.get(self.chunk_filename(0)))
+            file_count, index = divmod(position, self.box_size)
+        return next(islice((await self.cache.get(self.chunk_filename(file_count))).values(), index, None))
+
+'''
+The loaded output and the queries over it
+'''
+class Output:
+    def __init__(self):
+        self.cache = ChunkCache(CACHE_CHUNKS)
+        self.partitions = None
+        if os.path.exists(OUTPUT_DIR+"partitions_"+OUTPUT_FILENAME+".json"):
+            self.partitions = {partition["partition"]:TweetFiles(partition["name"], self.cache, partition["min_id"], partition["max_id"])
+                               for partition in load_json("partitions_"+OUTPUT_FILENAME+".json")["partitions"]}
+            self.tweet_files = list(self.partitions.values())
+        else:
+            self.tweet_files = [TweetFiles(OUTPUT_FILENAME, self.cache)]
+        self.user_lookup = ChunkLookup("disp_userids_", "disp_uranges_", OUTPUT_FILENAME)
+        self.indexes = load_indexes()
+
+    async def get_tweet(self, twid):
+        for tweet_files in self.tweet_files:
+            tweet = await tweet_files.find_tweet(twid)
+            if tweet is not None:
+                return tweet
+        raise HTTPError(404, "no tweet "+twid)
+
+    async def get_user(self, userid):
+        chunk_fn = self.user_lookup.find(userid)
+        user = None if chunk_fn is None else (await self.cache.get(chunk_fn)).get(userid)
+        if user is None:
+            raise HTTPError(404, "no user "+userid)
+        return user
+
+    async def get_tweets(self, twids):
+        return [await self.get_tweet(twid) for twid in twids]
+
+    '''
+    The tweet files a sort order is read from: the whole output, or the
+    named partition of partitioned output
+    '''
+    def sorted_files(self, partition):
+        if self.partitions is None:
+            if partition is not None:
+                raise HTTPError(400, "the output isn't partitioned")
+            return self.tweet_files[0]
+        if partition is None:
+            raise HTTPError(400, "partitioned output: pass partition=<a partition of partitions_"+OUTPUT_FILENAME+".json>")
+        if partition not in self.partitions:
+            raise HTTPError(404, "no partition "+partition)
+        return self.partitions[partition]
+
+    async def sorted_page(self, order, page, size, partition=None):
+        tweet_files = self.sorted_files(partition)
+        if order not in tweet_files.sort_lists:
+            raise HTTPError(404, "no sort list for "+order)
+        sort_list = tweet_files.sort_lists[order]
+        return {"total":sort_list.total, "tweets":await sort_list.tweets(tweet_files, page*size, (page+1)*size)}
+
+    async def retweeters(self, twid, page, size):
+        retweets = (await self.get_tweet(twid)).get("retweets", [])
+        return {"total":len(retweets), "retweets":retweets[page*size:(page+1)*size]}
+
+    async def search(self, query, page, size):
+        if not self.indexes:
+            raise HTTPError(503, "no search index loaded")
+        matches = await asyncio.get_running_loop().run_in_executor(None, self.search_indexes, query)
+        page_matches = matches[page*size:(page+1)*size]
+        tweets = await self.get_tweets([match["ref"] for match in page_matches])
+        return {"total":len(matches), "scores":[match["score"] for match in page_matches], "tweets":tweets}
+
+    '''
+    Search every shard. Lunr scores depend on each shard's own term
+    statistics, so they aren't compared across shards: matches are ranked
+    within their shard, then interleaved, every shard's best match first,
+    then every shard's second, and so on, higher scores first within a rank.
+    '''
+    def search_indexes(self, query):
+        try:
+            shard_matches = [index.search(query) for index in self.indexes]
+        except Exception as e:
+            raise HTTPError(400, "bad query: "+str(e))
+        ranked = [(rank, match) for matches in shard_matches for rank, match in enumerate(matches)]
+        ranked.sort(key=lambda item: (item[0], -item[1]["score"]))
+        return [match for rank, match in ranked]
+
+'''
+Return the page and page size parameters
+'''
+def page_params(params):
+    try:
+        page = int(params.get("page", ["0"])[0])
+        size = int(params.get("size", [str(PAGE_SIZE)])[0])
+    except ValueError:
+        raise HTTPError(400, "page and size must be integers")
+    if page < 0 or not 0 < size <= MAX_PAGE_SIZE:
+        raise HTTPError(400, "page must be >= 0 and size 1.."+str(MAX_PAGE_SIZE))
+    return page, size
+
+'''
+Route a GET request target to its query
+'''
+async def route(output, target):
+    url = urlsplit(target)
+    parts = [unquote(part) for part in url.path.strip("/").split("/")]
+    params = parse_qs(url.query)
+    if len(parts) == 2 and parts[0] == "tweet":
+        return await output.get_tweet(parts[1])
+    if len(parts) == 2 and parts[0] == "user":
+        return await output.get_user(parts[1])
+    if len(parts) == 2 and parts[0] == "sorted":
+        return await output.sorted_page(parts[1], *page_params(params), params.get("partition", [None])[0])
+    if len(parts) == 2 and parts[0] == "retweeters":
+        return await output.retweeters(parts[1], *page_params(params))
+    if parts == ["search"]:
+        if "q" not in params:
+            raise HTTPError(400, "missing q")
+        return await output.search(params["q"][0], *page_params(params))
+    raise HTTPError(404, "unknown path "+url.path)
+
+'''
+Read a request line or header
+'''
+async def read_line(reader):
+    try:
+        return await reader.readline()
+    except ValueError:
+        # past the stream limit, with the rest of the line left unread
+        raise HTTPError(400, "request line or header too long")
+
+'''
+Serve the requests of one connection, keeping it alive unless the client
+asks to close it. Every request read gets a response: errors in the
+output files (a missing or corrupt chunk) and anything unexpected are a
+500, logged with their traceback.
+'''
+async def handle_connection(output, reader, writer):
+    try:
+        while True:
+            # HTTP/1.0 until the request line says otherwise, which closes
+            # the connection after an unreadable request
+            version = "HTTP/1.0"
+            headers = {}
+            try:
+                request_line = await read_line(reader)
+                if not request_line.strip():
+                    break
+                while True:
+                    header = await read_line(reader)
+                    if not header.strip():
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                request = request_line.decode("latin-1").split()
+                if len(request) != 3:
+                    raise HTTPError(400, "malformed request line")
+                method, target, version = request
+                if method != "GET":
+                    raise HTTPError(405, "only GET is supported")
+                status, body = 200, await route(output, target)
+            except HTTPError as e:
+                status, body = e.status, {"error":str(e)}
+            except ConnectionError:
+                raise
+            except (json.JSONDecodeError, OSError):
+                traceback.print_exc()
+                status, body = 500, {"error":"unreadable output file"}
+            except Exception:
+                traceback.print_exc()
+                status, body = 500, {"error":"internal error"}
+
+            keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+            data = json.dumps(body, separators=(",",":")).encode("UTF-8")
+            writer.write(("HTTP/1.1 "+str(status)+" "+REASONS[status]+"\r\n"
+                          "Content-Type: application/json\r\n"
+                          "Content-Length: "+str(len(data))+"\r\n"
+                          "Connection: "+("keep-alive" if keep_alive else "close")+"\r\n\r\n").encode("latin-1")+data)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def serve():
+    output = Output()
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(output, reader, writer), HOST, PORT)
+    print("Serving", OUTPUT_DIR, "on http://"+HOST+":"+str(PORT), "with", len(output.indexes), "search index shards")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve())
+    except OutputError as e:
+        sys.exit("Can't serve "+OUTPUT_DIR+": "+str(e))
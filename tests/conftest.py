@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the scripts import their siblings by name, as when run from their own directory
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for directory in ["process", "bench"]:
+    sys.path.insert(0, os.path.join(REPO_DIR, directory))
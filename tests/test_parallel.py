@@ -0,0 +1,85 @@
+import os
+import gzip
+
+import pytest
+
+from generate import DumpGenerator
+from store import open_store
+from display import DisplaySink
+from pipeline import run_pipeline, shard_ranges
+from process import TWEET_SCHEMA, USER_SCHEMA, USER_SIZE_BOUNDS, TZ_OFFSET
+
+# small chunks, so every output has several
+BOX_SIZE = 100
+
+'''
+Data files for every case: a generated dump, the same gzipped (read in
+line batches rather than byte ranges), a duplicate-heavy one where most
+lines repeat others near and far, and dumps of fewer lines than workers,
+down to an empty one with fewer bytes than workers
+'''
+@pytest.fixture(scope="module")
+def data_dir(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp("data")
+    lines = list(DumpGenerator(1500).iter_lines())
+    files = {
+        "dump.json":lines,
+        "dump.json.gz":lines,
+        "duplicates.json":[line for i in range(0, 300, 3) for line in lines[i:i+3]*4]+lines[:300],
+        "three.json":lines[:3],
+        "one.json":lines[:1],
+        "empty.json":[],
+    }
+    for filename, file_lines in files.items():
+        data = "".join(file_lines).encode("UTF-8")
+        with open(data_dir/filename, "wb") as outfile:
+            outfile.write(gzip.compress(data, mtime=0) if filename.endswith(".gz") else data)
+    return data_dir
+
+'''
+Run process.py's display output over data files with workers, returning
+{filename: bytes} of the output
+'''
+def run_display(data_dir, output_dir, data_files, workers):
+    os.makedirs(output_dir)
+    store = open_store("memory", None, list(TWEET_SCHEMA)+["hashtags","local_date"])
+    sink = DisplaySink(store, TWEET_SCHEMA, USER_SCHEMA, USER_SIZE_BOUNDS, TZ_OFFSET, "test",
+                       box_size=BOX_SIZE, output_dir=str(output_dir)+"/", sort_format="both")
+    run_pipeline(data_files, [sink], data_dir=str(data_dir)+"/", workers=workers, checkpoint_lines=BOX_SIZE)
+    output = {}
+    for filename in os.listdir(output_dir):
+        with open(os.path.join(output_dir, filename), "rb") as infile:
+            output[filename] = infile.read()
+    return output
+
+@pytest.mark.parametrize("workers", [2, 7])
+@pytest.mark.parametrize("data_files", [
+    ["dump.json"],
+    ["dump.json.gz"],
+    ["duplicates.json"],
+    ["three.json"],
+    ["one.json"],
+    ["empty.json", "one.json"],
+    ["three.json", "dump.json", "duplicates.json"],
+])
+def test_parallel_output_matches_serial(data_dir, tmp_path, data_files, workers):
+    serial = run_display(data_dir, tmp_path/"serial", data_files, 0)
+    parallel = run_display(data_dir, tmp_path/"parallel", data_files, workers)
+    assert sorted(parallel) == sorted(serial)
+    for filename in serial:
+        assert parallel[filename] == serial[filename], filename
+
+@pytest.mark.parametrize("shard_count", range(1, 9))
+@pytest.mark.parametrize("data", [b"", b"a\n", b"ab\ncd\n", b"x\n"*3+b"y"*40+b"\n"+b"z\n", b"a"*20+b"\n"+b"b\n"*30])
+def test_shard_ranges_split_on_line_starts(tmp_path, data, shard_count):
+    path = str(tmp_path/"lines.json")
+    with open(path, "wb") as outfile:
+        outfile.write(data)
+    line_starts = [0]+[i+1 for i, byte in enumerate(data) if byte == ord("\n")]
+    for start in line_starts:
+        ranges = shard_ranges(path, shard_count, start)
+        assert len(ranges) <= shard_count
+        bounds = [start]+[end for shard_path, shard_start, end in ranges]
+        assert [shard_start for shard_path, shard_start, end in ranges] == bounds[:-1]
+        assert bounds[-1] == len(data)
+        assert all(bound in line_starts for bound in bounds)
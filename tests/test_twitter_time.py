@@ -0,0 +1,80 @@
+import random
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from twitter_time import DATE_FORMAT, parse_created_at, parse_account_created_at
+
+# EDT and EST
+TZ_OFFSETS = [-4, -5]
+
+# UTC times around the 2017 EDT/EST switches (2am local: 07:00 UTC on
+# March 12, 06:00 UTC on November 5), when the local date changes at
+# either offset, and around month and year ends
+BOUNDARY_STRINGS = [
+    "Sun Mar 12 06:59:59 +0000 2017",
+    "Sun Mar 12 07:00:00 +0000 2017",
+    "Sun Nov 05 05:59:59 +0000 2017",
+    "Sun Nov 05 06:00:00 +0000 2017",
+    "Mon Aug 14 03:59:59 +0000 2017",
+    "Mon Aug 14 04:00:00 +0000 2017",
+    "Mon Aug 14 04:59:59 +0000 2017",
+    "Mon Aug 14 05:00:00 +0000 2017",
+    "Tue Oct 31 23:59:59 +0000 2017",
+    "Wed Nov 01 00:00:00 +0000 2017",
+    "Sun Dec 31 23:59:59 +0000 2017",
+    "Mon Jan 01 00:00:00 +0000 2018",
+    "Mon Jan 01 03:59:59 +0000 2018",
+    "Mon Jan 01 04:00:00 +0000 2018",
+    "Mon Jan 01 05:00:00 +0000 2018",
+    "Sat Dec 31 23:59:59 +0000 2016",
+    "Mon Feb 29 12:00:00 +0000 2016",
+    # non-UTC offsets put the written year on the other side of UTC's
+    "Sun Dec 31 22:00:00 -0500 2017",
+    "Mon Jan 01 01:00:00 +0130 2018",
+    "Mon Aug 14 02:00:00 -0500 2017",
+    "Mon Aug 14 22:00:00 +0130 2017",
+]
+
+'''
+Every hour of three days from each start, at a random second, and random
+account creation times since Twitter launched
+'''
+def sample_strings():
+    rng = random.Random(0)
+    samples = []
+    for start in ["2017-03-11", "2017-08-11", "2017-10-31", "2017-11-04", "2017-12-30", "2016-02-28"]:
+        base = datetime.strptime(start, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        for hour in range(72):
+            samples.append(base + timedelta(hours=hour, seconds=rng.randrange(3600)))
+    for i in range(20000):
+        samples.append(datetime(2006, 3, 21, tzinfo=timezone.utc) + timedelta(seconds=rng.randrange(12*365*86400)))
+    return [dt.strftime("%a %b %d %H:%M:%S +0000 %Y") for dt in samples]
+
+'''
+(epoch, local_date, created_year) the way they were computed before the
+fast path, with strptime, astimezone and strftime
+'''
+def strptime_path(created_at, tz_offset):
+    dt = datetime.strptime(created_at, DATE_FORMAT)
+    local_date = dt.astimezone(timezone(timedelta(hours=tz_offset))).strftime('%Y-%m-%d')
+    return int(dt.timestamp()), local_date, dt.strftime('%Y')
+
+@pytest.mark.parametrize("tz_offset", TZ_OFFSETS)
+@pytest.mark.parametrize("created_at", BOUNDARY_STRINGS)
+def test_boundaries_match_strptime(created_at, tz_offset):
+    epoch, local_date, year = strptime_path(created_at, tz_offset)
+    assert parse_created_at(created_at, tz_offset) == (epoch, local_date)
+    assert parse_account_created_at(created_at) == (epoch, year)
+
+@pytest.mark.parametrize("tz_offset", TZ_OFFSETS)
+def test_samples_match_strptime(tz_offset):
+    for created_at in sample_strings():
+        epoch, local_date, year = strptime_path(created_at, tz_offset)
+        assert parse_created_at(created_at, tz_offset) == (epoch, local_date), created_at
+        assert parse_account_created_at(created_at) == (epoch, year), created_at
+
+def test_off_layout_falls_back_to_strptime():
+    created_at = "Mon Aug 14 2:00:00 +0000 2017"
+    epoch, local_date, year = strptime_path(created_at, -4)
+    assert parse_created_at(created_at, -4) == (epoch, local_date)